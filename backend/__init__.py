@@ -2,6 +2,7 @@ import os
 from pathlib import Path
 
 from flask import Flask
+from flask_compress import Compress
 from flask_cors import CORS
 
 from . import config, db, security, shared
@@ -18,15 +19,26 @@ def create_app():
     project_root = Path(__file__).resolve().parents[1]
     static_folder = project_root / 'dist'
     app = Flask(__name__, static_folder=str(static_folder), static_url_path='')
+    app.json = shared.OrjsonJSONProvider(app)
     CORS(app)
 
     os.makedirs(config.UPLOAD_FOLDER, exist_ok=True)
     app.config['UPLOAD_FOLDER'] = config.UPLOAD_FOLDER
     app.config['MAX_CONTENT_LENGTH'] = 20 * 1024 * 1024
+    app.config['USE_X_SENDFILE'] = config.USE_X_SENDFILE
+    app.config['COMPRESS_ALGORITHM'] = ['br', 'gzip']
+    app.config['COMPRESS_LEVEL'] = 6
+    app.config['COMPRESS_BR_LEVEL'] = 4
+    app.config['COMPRESS_MIN_SIZE'] = 512
+    Compress(app)
 
     shared.app = app
+    shared.static_files = shared.build_static_file_set(app.static_folder)
     db.init_db()
+    if config.PRELOAD_LOCAL_OCR:
+        shared.get_local_ocr_engine()
     app.before_request(security.enforce_auth_token_middleware)
+    app.teardown_appcontext(db.close_request_connections)
 
     app.register_blueprint(auth_bp)
     app.register_blueprint(workspaces_bp)
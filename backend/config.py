@@ -1,6 +1,5 @@
 import os
 
-import boto3
 from docx.enum.text import WD_COLOR_INDEX
 
 try:
@@ -42,6 +41,14 @@ HF_MODEL_BASE_URL = (os.environ.get('HF_MODEL_BASE_URL') or 'https://router.hugg
 OCR_MODEL_ID = os.environ.get('HF_OCR_MODEL') or 'lbin2021/my-lecture-ocr'
 SUMMARIZER_MODEL_ID = os.environ.get('HF_SUMMARIZER_MODEL') or 'facebook/bart-large-cnn'
 EXTERNAL_OCR_SERVICE_URL = (os.environ.get('EXTERNAL_OCR_SERVICE_URL') or '').strip()
+_local_ocr_enabled_raw = str(os.getenv('ENABLE_LOCAL_OCR') or '1').strip().lower()
+ENABLE_LOCAL_OCR = _local_ocr_enabled_raw not in ('0', 'false', 'no', 'off')
+_preload_local_ocr_raw = str(os.getenv('PRELOAD_LOCAL_OCR') or '0').strip().lower()
+PRELOAD_LOCAL_OCR = _preload_local_ocr_raw not in ('0', 'false', 'no', 'off')
+try:
+    LOCAL_OCR_THREADS = max(1, int((os.getenv('LOCAL_OCR_THREADS') or str(os.cpu_count() or 1)).strip()))
+except Exception:
+    LOCAL_OCR_THREADS = max(1, os.cpu_count() or 1)
 try:
     EXTERNAL_OCR_TIMEOUT_SECONDS = max(15, int((os.getenv('EXTERNAL_OCR_TIMEOUT_SECONDS') or '60').strip()))
 except Exception:
@@ -50,10 +57,17 @@ OCRMYPDF_BINARY = (os.getenv('OCRMYPDF_BINARY') or 'ocrmypdf').strip() or 'ocrmy
 OCRMYPDF_LANGUAGE = (os.getenv('OCRMYPDF_LANGUAGE') or 'eng').strip() or 'eng'
 _pdf_ocr_enabled_raw = str(os.getenv('ENABLE_PDF_OCR_FALLBACK') or '1').strip().lower()
 ENABLE_PDF_OCR_FALLBACK = _pdf_ocr_enabled_raw not in ('0', 'false', 'no', 'off')
+try:
+    OCRMYPDF_JOBS = max(1, int((os.getenv('OCRMYPDF_JOBS') or str(os.cpu_count() or 1)).strip()))
+except Exception:
+    OCRMYPDF_JOBS = max(1, os.cpu_count() or 1)
 try:
     OCRMYPDF_TIMEOUT_SECONDS = max(15, int((os.getenv('OCRMYPDF_TIMEOUT_SECONDS') or '180').strip()))
 except Exception:
     OCRMYPDF_TIMEOUT_SECONDS = 180
+# Only enable behind a proxy that honours X-Sendfile; plain gunicorn would send empty bodies.
+_use_x_sendfile_raw = str(os.getenv('USE_X_SENDFILE') or '0').strip().lower()
+USE_X_SENDFILE = _use_x_sendfile_raw in ('1', 'true', 'yes', 'on')
 try:
     TRASH_RETENTION_DAYS = max(1, min(365, int((os.getenv('TRASH_RETENTION_DAYS') or '30').strip())))
 except Exception:
@@ -121,6 +135,30 @@ DEFAULT_WORKSPACE_SETTINGS = {
     'allow_export': True,
 }
 SUMMARY_CACHE_VERSION = 'v2'
+try:
+    SUMMARY_MIN_WORDS = max(0, int((os.getenv('SUMMARY_MIN_WORDS') or '40').strip()))
+except Exception:
+    SUMMARY_MIN_WORDS = 40
+try:
+    ANALYZE_TEXT_MAX_CHARS = max(4000, int((os.getenv('ANALYZE_TEXT_MAX_CHARS') or '120000').strip()))
+except Exception:
+    ANALYZE_TEXT_MAX_CHARS = 120000
+try:
+    ANALYSIS_MEMO_TTL_SECONDS = max(60, int((os.getenv('ANALYSIS_MEMO_TTL_SECONDS') or '86400').strip()))
+except Exception:
+    ANALYSIS_MEMO_TTL_SECONDS = 86400
+try:
+    ANALYSIS_MEMO_MAX_ITEMS = max(1, int((os.getenv('ANALYSIS_MEMO_MAX_ITEMS') or '256').strip()))
+except Exception:
+    ANALYSIS_MEMO_MAX_ITEMS = 256
+try:
+    OCR_MEMO_TTL_SECONDS = max(60, int((os.getenv('OCR_MEMO_TTL_SECONDS') or '86400').strip()))
+except Exception:
+    OCR_MEMO_TTL_SECONDS = 86400
+try:
+    OCR_MEMO_MAX_ITEMS = max(1, int((os.getenv('OCR_MEMO_MAX_ITEMS') or '512').strip()))
+except Exception:
+    OCR_MEMO_MAX_ITEMS = 512
 
 MIME_BY_EXT = {
     'pdf': 'application/pdf',
@@ -133,20 +171,20 @@ MIME_BY_EXT = {
     'webp': 'image/webp',
 }
 
-EDITOR_ALLOWED_TAGS = {
+EDITOR_ALLOWED_TAGS = frozenset({
     'p', 'br', 'strong', 'b', 'em', 'i', 'u', 's', 'strike', 'sub', 'sup', 'mark', 'span', 'div',
     'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'ul', 'ol', 'li', 'blockquote', 'pre',
     'code', 'a', 'table', 'thead', 'tbody', 'tr', 'th', 'td', 'colgroup', 'col', 'img', 'hr'
-}
-EDITOR_ALLOWED_STYLE_PROPS = {
+})
+EDITOR_ALLOWED_STYLE_PROPS = frozenset({
     'font-weight', 'font-style', 'text-decoration', 'color', 'background-color',
     'text-align', 'font-size', 'font-family', 'vertical-align', 'margin-left',
     'width', 'height', 'border', 'border-collapse'
-}
-BLOCK_TAGS = {
+})
+BLOCK_TAGS = frozenset({
     'p', 'div', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'li', 'blockquote', 'pre',
     'table', 'thead', 'tbody', 'tr', 'th', 'td', 'hr'
-}
+})
 
 NAMED_COLORS = {
     'black': (0, 0, 0),
@@ -192,14 +230,18 @@ RESEND_API_KEY = (os.environ.get('RESEND_API_KEY') or '').strip()
 RESEND_FROM_EMAIL = (os.environ.get('RESEND_FROM_EMAIL') or 'StudyHub <onboarding@resend.dev>').strip()
 INVITE_EXPIRY_DAYS = 7
 
-try:
-    s3_client = boto3.client(
-        's3',
-        aws_access_key_id=S3_KEY,
-        aws_secret_access_key=S3_SECRET,
-        region_name=S3_REGION,
-    )
-    print('✅ AWS S3 Client initialized.')
-except Exception as e:
-    print(f'⚠️ AWS S3 Client failed to initialize: {e}')
-    s3_client = None
+s3_client = None
+if S3_BUCKET:
+    try:
+        import boto3
+
+        s3_client = boto3.client(
+            's3',
+            aws_access_key_id=S3_KEY,
+            aws_secret_access_key=S3_SECRET,
+            region_name=S3_REGION,
+        )
+        print('✅ AWS S3 Client initialized.')
+    except Exception as e:
+        print(f'⚠️ AWS S3 Client failed to initialize: {e}')
+        s3_client = None
@@ -1,8 +1,59 @@
+import functools
 import os
+import queue
 import sqlite3
+import threading
 
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from flask import g, has_app_context
+from psycopg2.extras import RealDictCursor, execute_batch
+from psycopg2.pool import ThreadedConnectionPool
+
+try:
+    # gthread 请求线程 + 后台刷新线程都会取连接，留足余量
+    DB_POOL_MAX_CONNECTIONS = max(1, int((os.getenv('DB_POOL_MAX_CONNECTIONS') or '20').strip()))
+except Exception:
+    DB_POOL_MAX_CONNECTIONS = 20
+
+try:
+    DB_POOL_ACQUIRE_TIMEOUT_SECONDS = max(1, int((os.getenv('DB_POOL_ACQUIRE_TIMEOUT_SECONDS') or '10').strip()))
+except Exception:
+    DB_POOL_ACQUIRE_TIMEOUT_SECONDS = 10
+
+try:
+    SQLITE_CACHED_STATEMENTS = max(0, int((os.getenv('SQLITE_CACHED_STATEMENTS') or '256').strip()))
+except Exception:
+    SQLITE_CACHED_STATEMENTS = 256
+
+try:
+    SQLITE_POOL_SIZE = max(1, int((os.getenv('SQLITE_POOL_SIZE') or '8').strip()))
+except Exception:
+    SQLITE_POOL_SIZE = 8
+
+SQLITE_DB_PATH = 'database.db'
+SQLITE_CONNECTION_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-20000',
+    'PRAGMA mmap_size=268435456',
+)
+
+_pg_pool = None
+_pg_pool_lock = threading.Lock()
+# ThreadedConnectionPool 满了会直接抛 PoolError；用信号量让取连接的线程排队等待
+_pg_pool_slots = threading.BoundedSemaphore(DB_POOL_MAX_CONNECTIONS)
+_sqlite_idle_connections = queue.LifoQueue(maxsize=SQLITE_POOL_SIZE)
+_db_initialized = False
+
+
+class DatabasePoolExhausted(RuntimeError):
+    pass
+
+
+@functools.lru_cache(maxsize=512)
+def _pg_rewrite(query):
+    # SQL 文本基本都是常量，占位符替换结果缓存起来复用
+    return query.replace('?', '%s')
 
 
 class DBWrapper:
@@ -11,13 +62,14 @@ class DBWrapper:
     Render 使用 PostgreSQL (%s 占位符)，本地开发使用 SQLite (? 占位符)。
     """
 
-    def __init__(self, conn, db_type):
+    def __init__(self, conn, db_type, pool=None):
         self.conn = conn
         self.db_type = db_type
+        self.pool = pool
 
     def execute(self, query, params=()):
         if self.db_type == 'postgres':
-            query = query.replace('?', '%s')
+            query = _pg_rewrite(query)
 
         try:
             if self.db_type == 'postgres':
@@ -29,90 +81,203 @@ class DBWrapper:
             print(f'Database Execution Error: {e}')
             raise e
 
+    def executemany(self, query, seq_of_params):
+        if self.db_type == 'postgres':
+            query = _pg_rewrite(query)
+
+        try:
+            if self.db_type == 'postgres':
+                cursor = self.conn.cursor()
+                # cursor.executemany 在 psycopg2 里仍是逐条往返，execute_batch 会分页合并发送
+                execute_batch(cursor, query, seq_of_params)
+                return cursor
+            return self.conn.executemany(query, seq_of_params)
+        except Exception as e:
+            print(f'Database Execution Error: {e}')
+            raise e
+
     def commit(self):
         self.conn.commit()
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
     def close(self):
-        self.conn.close()
+        conn, self.conn = self.conn, None
+        if conn is None:
+            return
+        if self.db_type == 'sqlite':
+            release_sqlite_connection(conn)
+            return
+        if self.pool is None:
+            conn.close()
+            return
+        try:
+            # 归还连接池前回滚未提交的事务，避免脏状态带给下一个请求
+            try:
+                conn.rollback()
+            except Exception:
+                self.pool.putconn(conn, close=True)
+                return
+            self.pool.putconn(conn)
+        finally:
+            _pg_pool_slots.release()
+
+
+def get_pg_pool(database_url):
+    global _pg_pool
+    if _pg_pool is not None:
+        return _pg_pool
+    with _pg_pool_lock:
+        if _pg_pool is None:
+            _pg_pool = ThreadedConnectionPool(
+                1,
+                DB_POOL_MAX_CONNECTIONS,
+                database_url,
+                cursor_factory=RealDictCursor,
+            )
+    return _pg_pool
+
+
+def _open_sqlite_connection():
+    # SQL 文本都是模块里的常量字符串，语句缓存调大后同一条 SQL 不必重复 prepare
+    conn = sqlite3.connect(
+        SQLITE_DB_PATH,
+        cached_statements=SQLITE_CACHED_STATEMENTS,
+        check_same_thread=False,
+    )
+    conn.row_factory = sqlite3.Row
+    for pragma in SQLITE_CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def acquire_sqlite_connection():
+    # 连接在请求之间复用，页缓存和语句缓存都能保留下来
+    try:
+        return _sqlite_idle_connections.get_nowait()
+    except queue.Empty:
+        return _open_sqlite_connection()
+
+
+def release_sqlite_connection(conn):
+    try:
+        conn.rollback()
+        _sqlite_idle_connections.put_nowait(conn)
+    except Exception:
+        try:
+            conn.execute('PRAGMA optimize')
+        except Exception:
+            pass
+        conn.close()
+
+
+def _track_request_connection(wrapper):
+    # 请求里没走 finally 的连接，由 close_request_connections 在 teardown 时兜底归还
+    if has_app_context():
+        g.setdefault('_db_connections', []).append(wrapper)
+    return wrapper
+
+
+def close_request_connections(exc=None):
+    for wrapper in g.pop('_db_connections', ()):
+        wrapper.close()
 
 
 def get_db_connection():
     database_url = os.environ.get('DATABASE_URL')
 
     if database_url:
+        if database_url.startswith('postgres://'):
+            database_url = database_url.replace('postgres://', 'postgresql://', 1)
+
+        if not _pg_pool_slots.acquire(timeout=DB_POOL_ACQUIRE_TIMEOUT_SECONDS):
+            raise DatabasePoolExhausted(
+                f'No PostgreSQL connection became free within {DB_POOL_ACQUIRE_TIMEOUT_SECONDS}s '
+                f'(DB_POOL_MAX_CONNECTIONS={DB_POOL_MAX_CONNECTIONS})'
+            )
         try:
-            if database_url.startswith('postgres://'):
-                database_url = database_url.replace('postgres://', 'postgresql://', 1)
-
-            conn = psycopg2.connect(database_url, cursor_factory=RealDictCursor)
-            return DBWrapper(conn, 'postgres')
+            pool = get_pg_pool(database_url)
+            conn = pool.getconn()
+            if conn.closed:
+                pool.putconn(conn, close=True)
+                conn = pool.getconn()
         except Exception as e:
+            _pg_pool_slots.release()
             print(f'❌ PostgreSQL connection failed: {e}')
             return None
+        return _track_request_connection(DBWrapper(conn, 'postgres', pool))
 
-    conn = sqlite3.connect('database.db')
-    conn.row_factory = sqlite3.Row
-    return DBWrapper(conn, 'sqlite')
+    return _track_request_connection(DBWrapper(acquire_sqlite_connection(), 'sqlite'))
 
 
-def table_column_exists(conn, table_name, column_name):
+def get_table_columns(conn, table_name):
     safe_table = str(table_name or '').strip()
-    safe_column = str(column_name or '').strip()
-    if not safe_table or not safe_column:
-        return False
+    if not safe_table:
+        return set()
 
     if conn.db_type == 'sqlite':
         cursor = conn.execute(f'PRAGMA table_info({safe_table})')
         rows = cursor.fetchall()
-        return any((row['name'] if hasattr(row, 'keys') else row[1]) == safe_column for row in rows)
+        return {(row['name'] if hasattr(row, 'keys') else row[1]) for row in rows}
 
     cursor = conn.execute(
         '''
         SELECT column_name
         FROM information_schema.columns
-        WHERE table_name = ? AND column_name = ?
+        WHERE table_name = ?
         ''',
-        (safe_table, safe_column),
+        (safe_table,),
     )
-    return cursor.fetchone() is not None
+    return {(row['column_name'] if hasattr(row, 'keys') else row[0]) for row in cursor.fetchall()}
+
+
+def table_column_exists(conn, table_name, column_name):
+    safe_column = str(column_name or '').strip()
+    if not safe_column:
+        return False
+    return safe_column in get_table_columns(conn, table_name)
 
 
 def documents_column_exists(conn, column_name):
     return table_column_exists(conn, 'documents', column_name)
 
 
-def ensure_documents_column(conn, column_name, column_type='TEXT'):
-    safe_column = str(column_name or '').strip()
-    safe_type = str(column_type or 'TEXT').strip().upper()
-    if not safe_column:
-        return
-    if documents_column_exists(conn, safe_column):
-        return
-    conn.execute(f'ALTER TABLE documents ADD COLUMN {safe_column} {safe_type}')
+def ensure_table_columns(conn, table_name, columns):
+    # 一次查出已有列，只对缺失的列执行 ALTER
+    existing_columns = get_table_columns(conn, table_name)
+    for column_name, column_type in columns:
+        safe_column = str(column_name or '').strip()
+        safe_type = str(column_type or 'TEXT').strip().upper()
+        if not safe_column or safe_column in existing_columns:
+            continue
+        conn.execute(f'ALTER TABLE {table_name} ADD COLUMN {safe_column} {safe_type}')
 
 
 def ensure_documents_columns(conn):
-    ensure_documents_column(conn, 'content_html', 'TEXT')
-    ensure_documents_column(conn, 'category', 'TEXT')
-    ensure_documents_column(conn, 'workspace_id', 'TEXT')
-    ensure_documents_column(conn, 'deleted_at', 'TEXT')
-
-
-def ensure_workspaces_column(conn, column_name, column_type='TEXT'):
-    safe_column = str(column_name or '').strip()
-    safe_type = str(column_type or 'TEXT').strip().upper()
-    if not safe_column:
-        return
-    if table_column_exists(conn, 'workspaces', safe_column):
-        return
-    conn.execute(f'ALTER TABLE workspaces ADD COLUMN {safe_column} {safe_type}')
+    ensure_table_columns(conn, 'documents', (
+        ('content_html', 'TEXT'),
+        ('category', 'TEXT'),
+        ('workspace_id', 'TEXT'),
+        ('deleted_at', 'TEXT'),
+    ))
 
 
 def ensure_workspaces_columns(conn):
-    ensure_workspaces_column(conn, 'settings_json', 'TEXT')
+    ensure_table_columns(conn, 'workspaces', (
+        ('settings_json', 'TEXT'),
+    ))
 
 
 def init_db():
+    global _db_initialized
+    if _db_initialized:
+        return
+
     conn = get_db_connection()
     if not conn:
         print('⚠️ Warning: Could not connect to database for initialization.')
@@ -230,6 +395,11 @@ def init_db():
         ON workspace_members(workspace_id, username);
     '''
 
+    workspace_members_user_idx_sql = '''
+        CREATE INDEX IF NOT EXISTS idx_workspace_members_user_status
+        ON workspace_members(username, status);
+    '''
+
     workspace_owner_idx_sql = '''
         CREATE INDEX IF NOT EXISTS idx_workspaces_owner_username
         ON workspaces(owner_username);
@@ -255,20 +425,36 @@ def init_db():
         ON document_summary_cache(updated_at);
     '''
 
+    # 覆盖文档列表的 WHERE username = ? ORDER BY uploaded_at DESC, id DESC，也能服务单纯按 username 的查询
+    documents_user_time_idx_sql = '''
+        CREATE INDEX IF NOT EXISTS idx_documents_user_uploaded
+        ON documents(username, uploaded_at DESC, id DESC);
+    '''
+
     try:
-        conn.execute(users_sql)
-        conn.execute(docs_sql)
-        conn.execute(workspaces_sql)
-        conn.execute(workspace_members_sql)
-        conn.execute(workspace_invitations_sql)
-        conn.execute(document_share_links_sql)
-        conn.execute(document_summary_cache_sql)
-        conn.execute(workspace_members_unique_sql)
-        conn.execute(workspace_owner_idx_sql)
-        conn.execute(workspace_invitation_lookup_sql)
-        conn.execute(document_share_links_doc_idx_sql)
-        conn.execute(document_summary_cache_lookup_idx_sql)
-        conn.execute(document_summary_cache_recent_idx_sql)
+        schema_statements = [
+            users_sql,
+            docs_sql,
+            workspaces_sql,
+            workspace_members_sql,
+            workspace_invitations_sql,
+            document_share_links_sql,
+            document_summary_cache_sql,
+            workspace_members_unique_sql,
+            workspace_members_user_idx_sql,
+            workspace_owner_idx_sql,
+            workspace_invitation_lookup_sql,
+            document_share_links_doc_idx_sql,
+            document_summary_cache_lookup_idx_sql,
+            document_summary_cache_recent_idx_sql,
+            documents_user_time_idx_sql,
+        ]
+        if conn.db_type == 'postgres':
+            # psycopg2 可以一次发送多条语句，建表建索引只需一次往返
+            conn.execute('\n'.join(schema_statements))
+        else:
+            for statement in schema_statements:
+                conn.execute(statement)
         ensure_documents_columns(conn)
         ensure_workspaces_columns(conn)
 
@@ -276,6 +462,10 @@ def init_db():
 
         backfill_documents_workspace_ids(conn)
         conn.commit()
+        if conn.db_type == 'sqlite':
+            # 建完索引后让 SQLite 按需刷新统计信息，查询规划器才会选中新索引
+            conn.execute('PRAGMA optimize')
+        _db_initialized = True
         print('✅ Database tables initialized successfully.')
     except Exception as e:
         print(f'❌ Error initializing tables: {e}')
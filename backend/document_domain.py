@@ -1,3 +1,6 @@
+import atexit
+import functools
+import hashlib
 import io
 import os
 import re
@@ -5,13 +8,19 @@ import shutil
 import subprocess
 import sys
 import tempfile
+import threading
+import time
 from datetime import datetime, timedelta
 from html import escape as html_escape
 
 import docx
 import PyPDF2
+from cachetools import LRUCache
 from docx.enum.text import WD_ALIGN_PARAGRAPH, WD_COLOR_INDEX
+from docx.oxml.ns import qn
 from docx.shared import Pt, RGBColor
+from docx.table import Table
+from docx.text.paragraph import Paragraph
 from lxml import etree, html as lxml_html
 
 try:
@@ -20,26 +29,140 @@ except Exception as e:
     fitz = None
     print(f"⚠️ PyMuPDF unavailable: {e}")
 
+try:
+    from rapidocr_onnxruntime import RapidOCR
+except Exception:
+    RapidOCR = None
+
+try:
+    from PIL import Image
+except Exception:
+    Image = None
+
+try:
+    # Installed alongside rapidocr; used to hand the engine a pre-shrunk image.
+    import cv2
+    import numpy as np
+except Exception:
+    cv2 = None
+    np = None
+
 from .config import (
     BLOCK_TAGS,
     CATEGORY_KEYWORDS,
     DEFAULT_DOCUMENT_CATEGORY,
     EDITOR_ALLOWED_STYLE_PROPS,
     EDITOR_ALLOWED_TAGS,
+    ENABLE_LOCAL_OCR,
     ENABLE_PDF_OCR_FALLBACK,
     HIGHLIGHT_RGB_BY_INDEX,
+    LOCAL_OCR_THREADS,
     MIME_BY_EXT,
     NAMED_COLORS,
     OCRMYPDF_BINARY,
+    OCRMYPDF_JOBS,
     OCRMYPDF_LANGUAGE,
     OCRMYPDF_TIMEOUT_SECONDS,
     TRASH_RETENTION_DAYS,
 )
+from .db import get_db_connection
 from .storage import remove_document_file_from_storage
 from .utils import parse_int, row_to_dict
 from .workspace_domain import workspace_belongs_to_user
 
 
+_RE_STYLE_DECL = re.compile(r'(?:^|;)\s*([a-z-]+)\s*:([^;]*)', re.IGNORECASE)
+_RE_LEN_UNIT = re.compile(r'\d+(?:\.\d+)?(px|pt|em|rem|%)')
+_RE_BORDER = re.compile(r'[\w\s.#()-]+')
+_RE_DOCX_HEX = re.compile(r'[0-9A-Fa-f]{6}')
+_RE_RGB = re.compile(r'rgb\(\s*(\d{1,3})\s*,\s*(\d{1,3})\s*,\s*(\d{1,3})\s*\)')
+_RE_COLWIDTH = re.compile(r'\d+(,\d+)*')
+_RE_FONT_SIZE = re.compile(r'([0-9]+(?:\.[0-9]+)?)(pt|px|em|rem)?')
+_RE_BR = re.compile(r'<br\s*/?>', re.IGNORECASE)
+_RE_BLOCK_CLOSE = re.compile(
+    r'</(p|div|li|h[1-6]|blockquote|pre|ul|ol|table|thead|tbody|tr|th|td)>',
+    re.IGNORECASE,
+)
+_RE_HR = re.compile(r'<hr\s*/?>', re.IGNORECASE)
+_RE_TAG = re.compile(r'<[^>]+>')
+_RE_EXTRA_BLANK_LINES = re.compile(r'\n{3,}')
+_RE_SCRIPT_STYLE = re.compile(r'<(script|style)[^>]*>.*?</\1>', re.IGNORECASE | re.DOTALL)
+_RE_COMMENT = re.compile(r'<!--.*?-->', re.DOTALL)
+_RE_HEADING_STYLE = re.compile(r'heading\s*([1-6])')
+_PLAINTEXT_BREAK_TAGS = frozenset(BLOCK_TAGS | {'br', 'ul', 'ol'})
+
+_INLINE_NESTED_BLOCK_TAGS = frozenset(BLOCK_TAGS | {'ul', 'ol'})
+_XPATH_TABLE_ROWS = etree.XPath('.//tr')
+_editor_html_parser_local = threading.local()
+_XPATH_ROW_CELLS = etree.XPath('./td | ./th')
+_DOCX_PARAGRAPH_TAG = qn('w:p')
+_DOCX_TABLE_TAG = qn('w:tbl')
+
+_sanitized_html_cache = LRUCache(maxsize=256)
+_sanitized_html_lock = threading.Lock()
+
+_remote_ocr_images = LRUCache(maxsize=64)
+_remote_ocr_images_lock = threading.Lock()
+_local_ocr_engine = None
+_local_ocr_load_failed = False
+_local_ocr_lock = threading.Lock()
+
+DOCUMENT_TOUCH_FLUSH_SECONDS = 0.2
+_pending_document_touches = {}
+_document_touch_lock = threading.Lock()
+_document_touch_event = threading.Event()
+_document_touch_thread = None
+
+
+def queue_document_access_touch(doc_id, accessed_at):
+    """Record a document read; last_access_at is written in batches by a background thread."""
+    global _document_touch_thread
+    with _document_touch_lock:
+        # Same document read several times in one window only needs the newest timestamp.
+        _pending_document_touches[doc_id] = accessed_at
+        if _document_touch_thread is None or not _document_touch_thread.is_alive():
+            _document_touch_thread = threading.Thread(
+                target=_document_touch_worker,
+                name='document-touch-writer',
+                daemon=True,
+            )
+            _document_touch_thread.start()
+    _document_touch_event.set()
+
+
+def flush_document_access_touches():
+    with _document_touch_lock:
+        if not _pending_document_touches:
+            return 0
+        batch = [(accessed_at, doc_id) for doc_id, accessed_at in _pending_document_touches.items()]
+        _pending_document_touches.clear()
+
+    conn = get_db_connection()
+    if not conn:
+        print('⚠️ Skipped last_access_at flush: database connection failed')
+        return 0
+    try:
+        conn.executemany('UPDATE documents SET last_access_at = ? WHERE id = ?', batch)
+        conn.commit()
+        return len(batch)
+    except Exception as e:
+        print(f'⚠️ last_access_at flush failed: {e}')
+        return 0
+    finally:
+        conn.close()
+
+
+def _document_touch_worker():
+    while True:
+        _document_touch_event.wait()
+        _document_touch_event.clear()
+        time.sleep(DOCUMENT_TOUCH_FLUSH_SECONDS)
+        flush_document_access_touches()
+
+
+atexit.register(flush_document_access_touches)
+
+
 def hard_delete_document_record(conn, doc_id):
     safe_doc_id = parse_int(doc_id, 0, 0)
     if safe_doc_id <= 0:
@@ -123,6 +246,16 @@ def user_can_edit_document(conn, doc_row, username=''):
 
 def normalize_newlines(value):
     text = value if isinstance(value, str) else str(value or '')
+    if '\r' not in text:
+        return text
+    return text.replace('\r\n', '\n').replace('\r', '\n')
+
+
+def normalize_cell_text(value):
+    # Strip first: edge CRs go with the whitespace, and most cells never reach the replace.
+    text = (value or '').strip()
+    if '\r' not in text:
+        return text
     return text.replace('\r\n', '\n').replace('\r', '\n')
 
 
@@ -140,16 +273,18 @@ def infer_document_category(title, text_content=''):
 
 
 def sanitize_style_declarations(style_text):
+    if not isinstance(style_text, str) or not style_text:
+        return {}
+    return dict(_sanitize_style_items(style_text))
+
+
+@functools.lru_cache(maxsize=2048)
+def _sanitize_style_items(style_text):
     style_map = {}
-    if not isinstance(style_text, str):
-        return style_map
 
-    for declaration in style_text.split(';'):
-        if ':' not in declaration:
-            continue
-        prop, val = declaration.split(':', 1)
-        prop = prop.strip().lower()
-        val = val.strip()
+    for match in _RE_STYLE_DECL.finditer(style_text):
+        prop = match.group(1).lower()
+        val = match.group(2).strip()
         if prop not in EDITOR_ALLOWED_STYLE_PROPS or not val:
             continue
 
@@ -167,18 +302,18 @@ def sanitize_style_declarations(style_text):
                 continue
             val = ', '.join(cleaned_parts[:3])
         elif prop in ('width', 'height', 'margin-left'):
-            if not re.fullmatch(r'\d+(?:\.\d+)?(px|pt|em|rem|%)', lower_val):
+            if not _RE_LEN_UNIT.fullmatch(lower_val):
                 continue
         elif prop == 'border-collapse':
             if lower_val not in ('collapse', 'separate'):
                 continue
         elif prop == 'border':
-            if not re.fullmatch(r'[\w\s.#()-]+', val):
+            if not _RE_BORDER.fullmatch(val):
                 continue
 
         style_map[prop] = val
 
-    return style_map
+    return tuple(style_map.items())
 
 
 def style_map_to_inline(style_map):
@@ -187,6 +322,7 @@ def style_map_to_inline(style_map):
     return '; '.join(f'{k}: {v}' for k, v in style_map.items())
 
 
+@functools.lru_cache(maxsize=512)
 def parse_css_color(color_value):
     if not isinstance(color_value, str):
         return None
@@ -197,24 +333,30 @@ def parse_css_color(color_value):
     if value in NAMED_COLORS:
         return NAMED_COLORS[value]
 
-    if re.fullmatch(r'#?[0-9a-f]{6}', value):
-        hex_color = value.lstrip('#')
-        return tuple(int(hex_color[idx:idx + 2], 16) for idx in (0, 2, 4))
+    if value.startswith('rgb('):
+        rgb_match = _RE_RGB.fullmatch(value)
+        if rgb_match:
+            return tuple(max(0, min(255, int(item))) for item in rgb_match.groups())
+        return None
 
-    rgb_match = re.fullmatch(
-        r'rgb\(\s*(\d{1,3})\s*,\s*(\d{1,3})\s*,\s*(\d{1,3})\s*\)',
-        value,
-    )
-    if rgb_match:
-        channels = [max(0, min(255, int(item))) for item in rgb_match.groups()]
-        return tuple(channels)
+    hex_color = value[1:] if value.startswith('#') else value
+    if len(hex_color) == 3 and value.startswith('#'):
+        hex_color = ''.join(ch * 2 for ch in hex_color)
+    if len(hex_color) == 6:
+        try:
+            channels = bytes.fromhex(hex_color)
+        except ValueError:
+            channels = b''
+        if len(channels) == 3:
+            return tuple(channels)
 
     return None
 
 
 def sanitize_int_attr(value, min_value=1, max_value=10000):
     raw = str(value or '').strip()
-    if not raw or not raw.isdigit():
+    # isascii() keeps Unicode digits like '²' (isdigit but not int-parsable) out.
+    if not raw or not (raw.isascii() and raw.isdigit()):
         return None
     number = int(raw)
     if number < min_value:
@@ -248,16 +390,13 @@ def sanitize_colwidth_attr(value):
     raw = str(value or '').strip()
     if not raw:
         return None
-    if re.fullmatch(r'\d+(,\d+)*', raw):
+    if _RE_COLWIDTH.fullmatch(raw):
         return raw
     return None
 
 
-def pick_highlight_index_from_css(color_value):
-    rgb = parse_css_color(color_value)
-    if not rgb:
-        return None
-
+@functools.lru_cache(maxsize=1024)
+def _nearest_highlight_index(rgb):
     closest_index = None
     closest_distance = None
     for index, target_rgb in HIGHLIGHT_RGB_BY_INDEX.items():
@@ -273,13 +412,22 @@ def pick_highlight_index_from_css(color_value):
     return closest_index
 
 
+@functools.lru_cache(maxsize=256)
+def pick_highlight_index_from_css(color_value):
+    rgb = parse_css_color(color_value)
+    if not rgb:
+        return None
+    return _nearest_highlight_index(tuple(rgb))
+
+
+@functools.lru_cache(maxsize=256)
 def parse_css_font_size_pt(size_value):
     if not isinstance(size_value, str):
         return None
     value = size_value.strip().lower()
     if not value:
         return None
-    match = re.fullmatch(r'([0-9]+(?:\.[0-9]+)?)(pt|px|em|rem)?', value)
+    match = _RE_FONT_SIZE.fullmatch(value)
     if not match:
         return None
 
@@ -324,41 +472,50 @@ def apply_block_style_to_paragraph(paragraph, style_map):
 
 def plaintext_to_html(content):
     text = normalize_newlines(content)
-    lines = text.split('\n')
-    if not lines:
-        return '<p><br></p>'
-
-    blocks = []
-    for line in lines:
-        if line == '':
-            blocks.append('<p><br></p>')
-        else:
-            blocks.append(f'<p>{html_escape(line)}</p>')
+    blocks = [
+        f'<p>{html_escape(line)}</p>' if line else '<p><br></p>'
+        for line in text.split('\n')
+    ]
     return ''.join(blocks) or '<p><br></p>'
 
 
+def element_to_plaintext(root):
+    # Appends a newline after every nested block/br; mutates the tails of root's descendants.
+    for el in root.iter():
+        if el is not root and isinstance(el.tag, str) and el.tag.lower() in _PLAINTEXT_BREAK_TAGS:
+            el.tail = '\n' + (el.tail or '')
+    text = etree.tostring(root, method='text', encoding='unicode', with_tail=False)
+    return clean_plaintext(text)
+
+
+def clean_plaintext(text):
+    text = text.replace('\xa0', ' ')
+    text = normalize_newlines(text)
+    text = _RE_EXTRA_BLANK_LINES.sub('\n\n', text)
+    return text.strip()
+
+
+def _editor_html_parser():
+    # lxml locks a parser while it parses, so each request thread keeps its own.
+    parser = getattr(_editor_html_parser_local, 'parser', None)
+    if parser is None:
+        parser = lxml_html.HTMLParser(recover=True, remove_comments=True)
+        _editor_html_parser_local.parser = parser
+    return parser
+
+
 def html_to_plaintext(content_html):
     if not isinstance(content_html, str) or not content_html.strip():
         return ''
 
-    normalized_html = re.sub(r'(?i)<br\s*/?>', '\n', content_html)
-    normalized_html = re.sub(
-        r'(?i)</(p|div|li|h[1-6]|blockquote|pre|ul|ol|table|thead|tbody|tr|th|td)>',
-        '\n',
-        normalized_html,
-    )
-    normalized_html = re.sub(r'(?i)<hr\s*/?>', '\n', normalized_html)
-
     try:
-        root = lxml_html.fragment_fromstring(normalized_html, create_parent='div')
-        text = root.text_content()
+        root = lxml_html.fragment_fromstring(content_html, create_parent='div', parser=_editor_html_parser())
     except Exception:
-        text = re.sub(r'<[^>]+>', '', normalized_html)
-
-    text = text.replace('\xa0', ' ')
-    text = normalize_newlines(text)
-    text = re.sub(r'\n{3,}', '\n\n', text)
-    return text.strip()
+        normalized_html = _RE_BR.sub('\n', content_html)
+        normalized_html = _RE_BLOCK_CLOSE.sub('\n', normalized_html)
+        normalized_html = _RE_HR.sub('\n', normalized_html)
+        return clean_plaintext(_RE_TAG.sub('', normalized_html))
+    return element_to_plaintext(root)
 
 
 def sanitize_editor_html(raw_html):
@@ -369,23 +526,36 @@ def sanitize_editor_html(raw_html):
     if not source_html:
         return '<p><br></p>'
 
-    source_html = re.sub(r'(?is)<(script|style)[^>]*>.*?</\1>', '', source_html)
-    source_html = re.sub(r'(?is)<!--.*?-->', '', source_html)
+    # Auto-save resubmits the same HTML over and over; key by digest so large notes aren't retained twice.
+    cache_key = hashlib.blake2b(source_html.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+    with _sanitized_html_lock:
+        cached = _sanitized_html_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    sanitized_html = _sanitize_editor_html_uncached(source_html)
+    with _sanitized_html_lock:
+        _sanitized_html_cache[cache_key] = sanitized_html
+    return sanitized_html
+
+
+def _sanitize_editor_html_uncached(source_html):
+    source_html = _RE_SCRIPT_STYLE.sub('', source_html)
+    source_html = _RE_COMMENT.sub('', source_html)
 
     try:
-        root = lxml_html.fragment_fromstring(source_html, create_parent='div')
+        root = lxml_html.fragment_fromstring(source_html, create_parent='div', parser=_editor_html_parser())
     except Exception:
         return plaintext_to_html(source_html)
 
-    present_tags = {el.tag.lower() for el in root.iter() if isinstance(el.tag, str)}
-    strip_tags = [tag for tag in present_tags if tag not in EDITOR_ALLOWED_TAGS]
-    if strip_tags:
-        etree.strip_tags(root, *strip_tags)
-
+    strip_tags = set()
     for el in root.iter():
         if not isinstance(el.tag, str):
             continue
         tag = el.tag.lower()
+        if el is not root and tag not in EDITOR_ALLOWED_TAGS:
+            strip_tags.add(el.tag)
+            continue
         style_map = sanitize_style_declarations(el.attrib.get('style', ''))
 
         sanitized_attrs = {}
@@ -443,43 +613,59 @@ def sanitize_editor_html(raw_html):
         if sanitized_attrs:
             el.attrib.update(sanitized_attrs)
 
-    serialized_parts = []
+    if strip_tags:
+        etree.strip_tags(root, *strip_tags)
+
+    leading_html = ''
     if root.text and root.text.strip():
-        serialized_parts.append(f'<p>{html_escape(root.text)}</p>')
-    for child in root:
-        serialized_parts.append(lxml_html.tostring(child, encoding='unicode', method='html'))
+        leading_html = f'<p>{html_escape(root.text)}</p>'
+    root.text = None
+    root.attrib.clear()
+    serialized = lxml_html.tostring(root, encoding='unicode', method='html')
+    inner_html = serialized[serialized.find('>') + 1:serialized.rfind('<')]
 
-    sanitized_html = ''.join(serialized_parts).strip()
+    sanitized_html = (leading_html + inner_html).strip()
     return sanitized_html or '<p><br></p>'
 
 
+_RUN_TOGGLE_PROPS = ('bold', 'italic', 'underline', 'strike')
+
+
 def apply_run_style(run, style_ctx):
-    run.bold = bool(style_ctx.get('bold'))
-    run.italic = bool(style_ctx.get('italic'))
-    run.underline = bool(style_ctx.get('underline'))
-    run.font.strike = bool(style_ctx.get('strike'))
-    has_subscript = bool(style_ctx.get('subscript'))
-    has_superscript = bool(style_ctx.get('superscript'))
+    # New runs inherit everything; only write the properties the style actually sets.
+    if not style_ctx:
+        return
+
+    font = run.font
+    for prop in _RUN_TOGGLE_PROPS:
+        value = style_ctx.get(prop)
+        if value is not None:
+            setattr(font, prop, bool(value))
+
+    has_subscript = style_ctx.get('subscript')
+    has_superscript = style_ctx.get('superscript')
     if has_subscript and has_superscript:
         has_subscript = False
-    run.font.subscript = has_subscript
-    run.font.superscript = has_superscript
+    if has_subscript is not None:
+        font.subscript = bool(has_subscript)
+    if has_superscript is not None:
+        font.superscript = bool(has_superscript)
 
     font_size_pt = style_ctx.get('font_size_pt')
     if isinstance(font_size_pt, (int, float)) and font_size_pt > 0:
-        run.font.size = Pt(font_size_pt)
+        font.size = Pt(font_size_pt)
 
     font_name = style_ctx.get('font_name')
     if isinstance(font_name, str) and font_name.strip():
-        run.font.name = font_name.strip()
+        font.name = font_name.strip()
 
     rgb = style_ctx.get('color_rgb')
     if isinstance(rgb, tuple) and len(rgb) == 3:
-        run.font.color.rgb = RGBColor(rgb[0], rgb[1], rgb[2])
+        font.color.rgb = RGBColor(rgb[0], rgb[1], rgb[2])
 
     highlight_index = style_ctx.get('highlight_index')
     if highlight_index in HIGHLIGHT_RGB_BY_INDEX:
-        run.font.highlight_color = highlight_index
+        font.highlight_color = highlight_index
 
 
 def add_text_to_paragraph(paragraph, text, style_ctx):
@@ -494,8 +680,16 @@ def add_text_to_paragraph(paragraph, text, style_ctx):
 
 
 def merge_inline_style(base_style, node):
-    style = dict(base_style or {})
     tag = node.tag.lower() if isinstance(node.tag, str) else ''
+    style = dict(base_style or {})
+    style.update(_inline_style_overrides(tag, node.attrib.get('style', '')))
+    return style
+
+
+@functools.lru_cache(maxsize=2048)
+def _inline_style_overrides(tag, style_attr):
+    # Editor HTML repeats the same <span style="..."> runs; parse each (tag, style) pair once.
+    style = {}
 
     if tag in ('strong', 'b'):
         style['bold'] = True
@@ -519,7 +713,7 @@ def merge_inline_style(base_style, node):
         style['underline'] = True
         style['color_rgb'] = (29, 78, 216)
 
-    style_map = sanitize_style_declarations(node.attrib.get('style', ''))
+    style_map = sanitize_style_declarations(style_attr)
     font_weight = (style_map.get('font-weight') or '').lower()
     if font_weight == 'bold':
         style['bold'] = True
@@ -559,36 +753,52 @@ def merge_inline_style(base_style, node):
     if font_family:
         style['font_name'] = font_family.split(',')[0].strip()
 
-    return style
+    return tuple(style.items())
 
 
 def add_inline_node_to_paragraph(paragraph, node, inherited_style=None):
-    current_style = merge_inline_style(inherited_style or {}, node)
-
-    if node.text:
-        add_text_to_paragraph(paragraph, node.text, current_style)
+    # Explicit stack instead of recursion: deeply nested editor spans neither pay a frame per
+    # level nor hit the recursion limit. Items are (node, style, text); node=None means "emit
+    # text". Children and tails are pushed in reverse so they pop in document order.
+    stack = [(node, inherited_style or {}, None)]
+    is_root = True
+    while stack:
+        current, parent_style, text = stack.pop()
+        if current is None:
+            add_text_to_paragraph(paragraph, text, parent_style)
+            continue
 
-    for child in node:
-        child_tag = child.tag.lower() if isinstance(child.tag, str) else ''
-        if child_tag == 'br':
+        child_tag = current.tag.lower() if isinstance(current.tag, str) else ''
+        if is_root:
+            is_root = False
+        elif child_tag == 'br':
             paragraph.add_run().add_break()
+            continue
         elif child_tag == 'img':
-            alt = (child.attrib.get('alt') or '').strip()
-            src = (child.attrib.get('src') or '').strip()
+            alt = (current.attrib.get('alt') or '').strip()
+            src = (current.attrib.get('src') or '').strip()
             placeholder = alt or src or 'Image'
-            add_text_to_paragraph(paragraph, f'[Image] {placeholder}', current_style)
+            add_text_to_paragraph(paragraph, f'[Image] {placeholder}', parent_style)
+            continue
         elif child_tag == 'hr':
-            add_text_to_paragraph(paragraph, '------------------------------', current_style)
-        elif child_tag in BLOCK_TAGS.union({'ul', 'ol'}):
-            nested_text = html_to_plaintext(lxml_html.tostring(child, encoding='unicode', method='html'))
+            add_text_to_paragraph(paragraph, '------------------------------', parent_style)
+            continue
+        elif child_tag in _INLINE_NESTED_BLOCK_TAGS:
+            nested_text = element_to_plaintext(current)
             if nested_text:
                 paragraph.add_run().add_break()
-                add_text_to_paragraph(paragraph, nested_text, current_style)
-        else:
-            add_inline_node_to_paragraph(paragraph, child, current_style)
+                add_text_to_paragraph(paragraph, nested_text, parent_style)
+            continue
+        elif not child_tag:
+            continue
 
-        if child.tail:
-            add_text_to_paragraph(paragraph, child.tail, current_style)
+        current_style = merge_inline_style(parent_style, current)
+        for child in reversed(current):
+            if child.tail:
+                stack.append((None, current_style, child.tail))
+            stack.append((child, current_style, None))
+        if current.text:
+            stack.append((None, current_style, current.text))
 
 
 def append_html_element_to_docx(document, element):
@@ -640,29 +850,10 @@ def append_html_element_to_docx(document, element):
         return
 
     if tag == 'table':
-        row_elements = []
-        for child in element.iter():
-            child_tag = child.tag.lower() if isinstance(child.tag, str) else ''
-            if child_tag == 'tr':
-                row_elements.append(child)
-
-        if not row_elements:
-            return
-
-        max_cols = 1
-        parsed_rows = []
-        for row_el in row_elements:
-            cells = [
-                cell for cell in row_el
-                if isinstance(cell.tag, str) and cell.tag.lower() in ('td', 'th')
-            ]
-            if not cells:
-                continue
-            parsed_rows.append(cells)
-            max_cols = max(max_cols, len(cells))
-
+        parsed_rows = [cells for cells in map(_XPATH_ROW_CELLS, _XPATH_TABLE_ROWS(element)) if cells]
         if not parsed_rows:
             return
+        max_cols = max(len(cells) for cells in parsed_rows)
 
         table = document.add_table(rows=len(parsed_rows), cols=max_cols)
         try:
@@ -670,14 +861,11 @@ def append_html_element_to_docx(document, element):
         except Exception:
             pass
 
-        for row_idx, row_cells in enumerate(parsed_rows):
-            for col_idx in range(max_cols):
-                target_cell = table.cell(row_idx, col_idx)
-                if col_idx >= len(row_cells):
-                    target_cell.text = ''
-                    continue
-                cell_text = normalize_newlines(row_cells[col_idx].text_content()).strip()
-                target_cell.text = cell_text
+        # table.cell() rebuilds the whole cell grid per call; walk rows once instead.
+        # New cells start empty, so only filled ones are assigned.
+        for docx_row, row_cells in zip(table.rows, parsed_rows):
+            for target_cell, cell_el in zip(docx_row.cells, row_cells):
+                target_cell.text = normalize_cell_text(cell_el.text_content())
         return
 
     if tag == 'img':
@@ -701,7 +889,7 @@ def create_docx_bytes_from_html(content_html, fallback_text=''):
     document = docx.Document()
 
     try:
-        root = lxml_html.fragment_fromstring(html_content, create_parent='div')
+        root = lxml_html.fragment_fromstring(html_content, create_parent='div', parser=_editor_html_parser())
     except Exception:
         root = None
 
@@ -713,10 +901,13 @@ def create_docx_bytes_from_html(content_html, fallback_text=''):
         if root.text and root.text.strip():
             document.add_paragraph(root.text.strip())
 
-        for child in root:
+        # Drop each top-level block once it is in the docx so the two trees aren't both held in full.
+        while len(root):
+            child = root[0]
             append_html_element_to_docx(document, child)
             if child.tail and child.tail.strip():
                 document.add_paragraph(child.tail.strip())
+            root.remove(child)
 
         if not document.paragraphs:
             fallback_lines = normalize_newlines(fallback_text).split('\n')
@@ -725,8 +916,7 @@ def create_docx_bytes_from_html(content_html, fallback_text=''):
 
     stream = io.BytesIO()
     document.save(stream)
-    stream.seek(0)
-    return stream.read()
+    return stream.getvalue()
 
 
 def run_to_html(run):
@@ -735,63 +925,77 @@ def run_to_html(run):
         return ''
 
     chunk = html_escape(raw_text).replace('\n', '<br/>')
+    # run.font / font.color build a new proxy on every access; resolve them once per run.
+    font = run.font
     style_parts = []
 
-    font_size = run.font.size.pt if run.font and run.font.size else None
+    font_size = font.size.pt if font.size else None
     if font_size:
         style_parts.append(f'font-size: {round(font_size, 2)}pt')
 
-    font_name = run.font.name if run.font else ''
+    font_name = font.name
     if font_name:
         style_parts.append(f'font-family: {html_escape(font_name)}')
 
-    font_color = run.font.color.rgb if run.font and run.font.color else None
+    font_color = font.color.rgb
     if font_color:
         color_hex = str(font_color)
-        if re.fullmatch(r'[0-9A-Fa-f]{6}', color_hex):
+        if _RE_DOCX_HEX.fullmatch(color_hex):
             style_parts.append(f'color: #{color_hex}')
 
-    highlight_color = run.font.highlight_color if run.font else None
+    highlight_color = font.highlight_color
     if highlight_color in HIGHLIGHT_RGB_BY_INDEX:
         rgb = HIGHLIGHT_RGB_BY_INDEX[highlight_color]
         style_parts.append(f'background-color: #{rgb[0]:02x}{rgb[1]:02x}{rgb[2]:02x}')
 
+    # Innermost first, matching the previous nesting order.
+    wrap_tags = []
+    if font.bold:
+        wrap_tags.append('strong')
+    if font.italic:
+        wrap_tags.append('em')
+    if font.underline:
+        wrap_tags.append('u')
+    if font.strike:
+        wrap_tags.append('s')
+    if font.subscript:
+        wrap_tags.append('sub')
+    if font.superscript:
+        wrap_tags.append('sup')
+
+    parts = [f'<{tag}>' for tag in reversed(wrap_tags)]
     if style_parts:
-        chunk = f'<span style="{"; ".join(style_parts)}">{chunk}</span>'
-
-    if run.bold:
-        chunk = f'<strong>{chunk}</strong>'
-    if run.italic:
-        chunk = f'<em>{chunk}</em>'
-    if run.underline:
-        chunk = f'<u>{chunk}</u>'
-    if run.font and run.font.strike:
-        chunk = f'<s>{chunk}</s>'
-    if run.font and run.font.subscript:
-        chunk = f'<sub>{chunk}</sub>'
-    if run.font and run.font.superscript:
-        chunk = f'<sup>{chunk}</sup>'
-
-    return chunk
+        parts.append(f'<span style="{"; ".join(style_parts)}">{chunk}</span>')
+    else:
+        parts.append(chunk)
+    parts.extend(f'</{tag}>' for tag in wrap_tags)
+    return ''.join(parts)
 
 
-def paragraph_to_html_block(paragraph):
+def paragraph_to_html_block(paragraph, text=None):
     style_name = (paragraph.style.name if paragraph.style else '').strip().lower()
     alignment = css_alignment_from_docx_alignment(paragraph.alignment)
     style_attr = f' style="text-align: {alignment}"' if alignment else ''
 
-    inline_html = ''.join(run_to_html(run) for run in paragraph.runs)
-    if not inline_html:
-        inline_html = html_escape(paragraph.text or '').replace('\n', '<br/>')
-    if not inline_html:
+    runs = paragraph.runs
+    if text is None:
+        text = paragraph.text or ''
+    if not runs and not text:
+        # Blank spacer paragraph: nothing to render or escape.
         inline_html = '<br/>'
+    else:
+        inline_html = ''.join(run_to_html(run) for run in runs)
+        if not inline_html:
+            inline_html = html_escape(text).replace('\n', '<br/>')
+        if not inline_html:
+            inline_html = '<br/>'
 
     if 'list bullet' in style_name:
         return 'ul', f'<li{style_attr}>{inline_html}</li>'
     if 'list number' in style_name:
         return 'ol', f'<li{style_attr}>{inline_html}</li>'
 
-    heading_match = re.search(r'heading\s*([1-6])', style_name)
+    heading_match = _RE_HEADING_STYLE.search(style_name)
     if heading_match:
         level = heading_match.group(1)
         return '', f'<h{level}{style_attr}>{inline_html}</h{level}>'
@@ -799,8 +1003,8 @@ def paragraph_to_html_block(paragraph):
     return '', f'<p{style_attr}>{inline_html}</p>'
 
 
-def extract_docx_content(filepath):
-    document = docx.Document(filepath)
+def extract_docx_content(source):
+    document = docx.Document(source)
     plain_lines = []
     html_parts = []
     list_type = ''
@@ -813,58 +1017,75 @@ def extract_docx_content(filepath):
         list_type = ''
         list_items = []
 
-    for paragraph in document.paragraphs:
-        plain_lines.append(paragraph.text or '')
-        block_type, block_html = paragraph_to_html_block(paragraph)
-        if block_type in ('ul', 'ol'):
-            if list_type and list_type != block_type:
+    # Walk the body XML once so paragraphs and tables come out in document order.
+    body = document.element.body
+    for element in body.iterchildren(_DOCX_PARAGRAPH_TAG, _DOCX_TABLE_TAG):
+        if element.tag == _DOCX_PARAGRAPH_TAG:
+            paragraph = Paragraph(element, document)
+            paragraph_text = paragraph.text or ''
+            plain_lines.append(paragraph_text)
+            block_type, block_html = paragraph_to_html_block(paragraph, paragraph_text)
+            if block_type in ('ul', 'ol'):
+                if list_type and list_type != block_type:
+                    flush_list()
+                list_type = block_type
+                list_items.append(block_html)
+            else:
                 flush_list()
-            list_type = block_type
-            list_items.append(block_html)
-        else:
-            flush_list()
-            html_parts.append(block_html)
-
-    flush_list()
+                html_parts.append(block_html)
+            continue
 
-    for table in document.tables:
-        row_html = []
+        flush_list()
+        if not element.tr_lst:
+            continue
+        # Table.rows/row.cells repeat a merged cell across its span, as document.tables did.
+        table = Table(element, document)
+        # Write cells straight into html_parts; the single join at the end does all the copying.
+        html_parts.append('<table><tbody>')
         for row in table.rows:
-            cell_html = []
-            cell_text_parts = []
-            for cell in row.cells:
-                text_value = normalize_newlines(cell.text or '').strip()
-                cell_text_parts.append(text_value)
-                cell_html.append(f'<td>{html_escape(text_value) if text_value else "<br/>"}</td>')
-            plain_lines.append(' | '.join(cell_text_parts).strip())
-            row_html.append(f'<tr>{"".join(cell_html)}</tr>')
-        if row_html:
-            html_parts.append(f'<table><tbody>{"".join(row_html)}</tbody></table>')
+            cell_texts = [normalize_cell_text(cell.text) for cell in row.cells]
+            plain_lines.append(' | '.join(cell_texts).strip())
+            html_parts.append('<tr>')
+            for text_value in cell_texts:
+                html_parts.append('<td>')
+                html_parts.append(html_escape(text_value) if text_value else '<br/>')
+                html_parts.append('</td>')
+            html_parts.append('</tr>')
+        html_parts.append('</tbody></table>')
+
+    flush_list()
 
     plain_text = '\n'.join(plain_lines)
     html_content = ''.join(html_parts).strip() or plaintext_to_html(plain_text)
     return plain_text, sanitize_editor_html(html_content)
 
 
-def extract_text_content(filepath):
-    with open(filepath, 'r', encoding='utf-8', errors='ignore') as f:
+def extract_text_content(source):
+    if hasattr(source, 'read'):
+        # Match text-mode open(): decode leniently and fold CRLF/CR like universal newlines.
+        return normalize_newlines(source.read().decode('utf-8', errors='ignore'))
+    with open(source, 'r', encoding='utf-8', errors='ignore') as f:
         return f.read()
 
 
-def extract_document_content(filepath, ext):
+def extract_document_content(source, ext):
+    """Extract (text, content_html) from a file path or a seekable binary stream."""
     file_ext = (ext or '').lower().strip('.')
     text = ''
     content_html = ''
 
     try:
         if file_ext == 'docx':
-            text, content_html = extract_docx_content(filepath)
+            text, content_html = extract_docx_content(source)
         elif file_ext == 'pdf':
-            with open(filepath, 'rb') as f:
-                file_bytes = f.read()
+            if hasattr(source, 'read'):
+                file_bytes = source.read()
+            else:
+                with open(source, 'rb') as f:
+                    file_bytes = f.read()
             text = extract_text_from_pdf_bytes(file_bytes)
         elif file_ext == 'txt':
-            text = extract_text_content(filepath)
+            text = extract_text_content(source)
             content_html = plaintext_to_html(text)
     except Exception as e:
         print(f"Error extracting content: {e}")
@@ -1032,13 +1253,138 @@ def extract_text_from_pdf_bytes_pypdf2(file_bytes):
     return normalize_pdf_text(text)
 
 
+def get_local_ocr_engine():
+    global _local_ocr_engine, _local_ocr_load_failed
+    if _local_ocr_engine is not None or _local_ocr_load_failed:
+        return _local_ocr_engine
+    if not ENABLE_LOCAL_OCR or RapidOCR is None:
+        return None
+    # Model load takes seconds; the lock keeps concurrent first requests from building two engines.
+    with _local_ocr_lock:
+        if _local_ocr_engine is None and not _local_ocr_load_failed:
+            try:
+                # rapidocr already builds its ONNX sessions with ORT_ENABLE_ALL; pin the thread pools
+                # so concurrent requests share cores instead of each spawning one thread per CPU.
+                _local_ocr_engine = RapidOCR(
+                    intra_op_num_threads=LOCAL_OCR_THREADS,
+                    inter_op_num_threads=1,
+                )
+            except Exception as e:
+                _local_ocr_load_failed = True
+                print(f"⚠️ Local OCR engine failed to load: {e}")
+    return _local_ocr_engine
+
+
+def is_local_ocr_engine_ready():
+    return _local_ocr_engine is not None
+
+
+def is_local_ocr_supported():
+    return ENABLE_LOCAL_OCR and RapidOCR is not None and not _local_ocr_load_failed
+
+
+LOCAL_OCR_MAX_IMAGE_SIDE = 2000
+REMOTE_OCR_MAX_IMAGE_SIDE = 1536
+REMOTE_OCR_JPEG_QUALITY = 85
+
+
+def _flatten_image_to_rgb(image):
+    if image.mode in ('RGBA', 'LA') or 'transparency' in image.info:
+        # Dark text on a transparent background would vanish on a black fill; use white.
+        rgba = image.convert('RGBA')
+        background = Image.new('RGB', rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def shrink_image_for_remote_ocr(img_bytes, mimetype='application/octet-stream'):
+    """Return (bytes, mimetype) no larger than REMOTE_OCR_MAX_IMAGE_SIDE, re-encoded as JPEG."""
+    if Image is None or not img_bytes:
+        return img_bytes, mimetype
+
+    cache_key = hashlib.blake2b(img_bytes, digest_size=16).digest()
+    with _remote_ocr_images_lock:
+        cached = _remote_ocr_images.get(cache_key)
+    if cached is not None:
+        # An empty entry means the original was already small enough; don't keep it alive here.
+        return cached or (img_bytes, mimetype)
+
+    result = ()
+    try:
+        with Image.open(io.BytesIO(img_bytes)) as image:
+            if max(image.size) > REMOTE_OCR_MAX_IMAGE_SIDE:
+                target = (REMOTE_OCR_MAX_IMAGE_SIDE, REMOTE_OCR_MAX_IMAGE_SIDE)
+                # For JPEG, draft() lets libjpeg decode at a reduced scale before the resize.
+                image.draft('RGB', target)
+                rgb_image = _flatten_image_to_rgb(image)
+                rgb_image.thumbnail(target, Image.LANCZOS)
+                buffer = io.BytesIO()
+                rgb_image.save(buffer, format='JPEG', quality=REMOTE_OCR_JPEG_QUALITY, optimize=True)
+                if buffer.tell() < len(img_bytes):
+                    result = (buffer.getvalue(), 'image/jpeg')
+    except Exception as e:
+        print(f"⚠️ OCR image downscale skipped: {e}")
+
+    with _remote_ocr_images_lock:
+        _remote_ocr_images[cache_key] = result
+    return result or (img_bytes, mimetype)
+
+
+def decode_image_for_local_ocr(img_bytes):
+    """Decode large photos at reduced scale; the detector downsizes them anyway."""
+    if cv2 is None or np is None or Image is None:
+        return img_bytes
+    try:
+        # Image.open only parses the header, so this is cheap even for big photos.
+        with Image.open(io.BytesIO(img_bytes)) as probe:
+            longest_side = max(probe.size)
+    except Exception:
+        return img_bytes
+
+    if longest_side > LOCAL_OCR_MAX_IMAGE_SIDE * 2:
+        flag = cv2.IMREAD_REDUCED_COLOR_4
+    elif longest_side > LOCAL_OCR_MAX_IMAGE_SIDE:
+        flag = cv2.IMREAD_REDUCED_COLOR_2
+    else:
+        return img_bytes
+
+    image = cv2.imdecode(np.frombuffer(img_bytes, dtype=np.uint8), flag)
+    return img_bytes if image is None else image
+
+
+def run_local_ocr_on_image_bytes(img_bytes):
+    engine = get_local_ocr_engine()
+    if engine is None:
+        return False, '', 'Local OCR engine is not available'
+    if not img_bytes:
+        return False, '', 'Empty image payload'
+
+    try:
+        result, _ = engine(decode_image_for_local_ocr(img_bytes))
+    except Exception as e:
+        return False, '', f'Local OCR failed: {e}'
+
+    lines = [str(item[1] or '').strip() for item in (result or []) if len(item) > 1]
+    text = '\n'.join(line for line in lines if line)
+    if not text:
+        return False, '', 'Local OCR returned empty text'
+    return True, text, ''
+
+
+@functools.lru_cache(maxsize=1)
+def get_ocrmypdf_path():
+    # The OCR toolchain is fixed for the life of the process; resolve it once.
+    return shutil.which(OCRMYPDF_BINARY) or ''
+
+
 def run_ocrmypdf_on_pdf_bytes(file_bytes):
     if not ENABLE_PDF_OCR_FALLBACK:
         return b'', 'ocrmypdf fallback disabled by ENABLE_PDF_OCR_FALLBACK'
     if not file_bytes:
         return b'', 'Empty PDF bytes'
 
-    ocrmypdf_path = shutil.which(OCRMYPDF_BINARY)
+    ocrmypdf_path = get_ocrmypdf_path()
     if not ocrmypdf_path:
         return b'', f'ocrmypdf binary not found: {OCRMYPDF_BINARY}'
 
@@ -1054,6 +1400,7 @@ def run_ocrmypdf_on_pdf_bytes(file_bytes):
                 '--force-ocr',
                 '--output-type', 'pdf',
                 '--optimize', '0',
+                '--jobs', str(OCRMYPDF_JOBS),
                 '--quiet',
                 '-l', OCRMYPDF_LANGUAGE,
                 input_path,
@@ -1166,10 +1513,6 @@ def create_pdf_bytes_from_text(content):
     text = content if isinstance(content, str) else str(content or '')
     text = text.replace('\r\n', '\n').replace('\r', '\n')
 
-    stream = io.BytesIO()
-    pdf_canvas = canvas.Canvas(stream, pagesize=A4)
-    page_width, page_height = A4
-
     font_name = 'Helvetica'
     font_size = 11
     try:
@@ -1178,34 +1521,54 @@ def create_pdf_bytes_from_text(content):
     except Exception:
         font_name = 'Helvetica'
 
-    pdf_canvas.setFont(font_name, font_size)
+    # showPage() resets to the canvas' initial font, so make ours the initial one instead of
+    # calling setFont again after every page break.
+    stream = io.BytesIO()
+    pdf_canvas = canvas.Canvas(
+        stream,
+        pagesize=A4,
+        initialFontName=font_name,
+        initialFontSize=font_size,
+    )
+    page_width, page_height = A4
+
     left_margin = 48
     top_margin = 56
     bottom_margin = 56
     line_height = 16
     max_line_width = page_width - (left_margin * 2)
 
+    char_widths = {}
+
+    def char_width(char):
+        width = char_widths.get(char)
+        if width is None:
+            try:
+                width = pdfmetrics.stringWidth(char, font_name, font_size)
+            except Exception:
+                width = font_size * 0.6
+            char_widths[char] = width
+        return width
+
     def wrap_paragraph(paragraph):
         if paragraph == '':
             return ['']
 
+        # Glyph widths are additive for these fonts, so keep a running total instead of
+        # re-measuring the whole candidate line on every character.
         wrapped = []
-        current = ''
-        for char in paragraph:
-            candidate = current + char
-            try:
-                text_width = pdfmetrics.stringWidth(candidate, font_name, font_size)
-            except Exception:
-                text_width = len(candidate) * font_size * 0.6
-
-            if text_width <= max_line_width or not current:
-                current = candidate
+        line_start = 0
+        current_width = 0.0
+        for idx, char in enumerate(paragraph):
+            width = char_width(char)
+            if current_width + width <= max_line_width or idx == line_start:
+                current_width += width
             else:
-                wrapped.append(current)
-                current = char
+                wrapped.append(paragraph[line_start:idx])
+                line_start = idx
+                current_width = width
 
-        if current or not wrapped:
-            wrapped.append(current)
+        wrapped.append(paragraph[line_start:])
         return wrapped
 
     y = page_height - top_margin
@@ -1217,19 +1580,17 @@ def create_pdf_bytes_from_text(content):
         for line in wrap_paragraph(paragraph):
             if y < bottom_margin:
                 pdf_canvas.showPage()
-                pdf_canvas.setFont(font_name, font_size)
                 y = page_height - top_margin
 
-            draw_text = line
-            if font_name == 'Helvetica':
-                draw_text = line.encode('latin-1', 'replace').decode('latin-1')
-
-            pdf_canvas.drawString(left_margin, y, draw_text)
+            if line:
+                draw_text = line
+                if font_name == 'Helvetica':
+                    draw_text = line.encode('latin-1', 'replace').decode('latin-1')
+                pdf_canvas.drawString(left_margin, y, draw_text)
             y -= line_height
 
     pdf_canvas.save()
-    stream.seek(0)
-    return stream.read()
+    return stream.getvalue()
 
 
 def build_editable_file_bytes(file_ext, content, content_html=''):
@@ -1253,12 +1614,21 @@ __all__ = [
     'extract_document_content',
     'extract_text_from_pdf_bytes',
     'extract_text_from_pdf_bytes_with_meta',
+    'flush_document_access_touches',
+    'get_local_ocr_engine',
+    'is_local_ocr_engine_ready',
+    'is_local_ocr_supported',
+    'get_ocrmypdf_path',
     'hard_delete_document_record',
     'html_to_plaintext',
     'infer_document_category',
+    'normalize_cell_text',
     'normalize_newlines',
     'plaintext_to_html',
     'purge_expired_trashed_documents',
+    'queue_document_access_touch',
+    'run_local_ocr_on_image_bytes',
     'sanitize_editor_html',
+    'shrink_image_for_remote_ocr',
     'user_can_edit_document',
 ]
@@ -1,6 +1,6 @@
-import io
 import os
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 from flask import current_app, jsonify, request, send_file
@@ -16,6 +16,7 @@ from .document_domain import (
     infer_document_category,
     plaintext_to_html,
     purge_expired_trashed_documents,
+    queue_document_access_touch,
     sanitize_editor_html,
     user_can_edit_document,
 )
@@ -25,11 +26,15 @@ from .share_domain import (
     is_document_soft_deleted,
     user_can_manage_document_share_links,
 )
-from .storage import allowed_file, detect_mimetype, read_file_bytes_from_storage, remove_document_file_from_storage, write_file_bytes_to_storage
+from .storage import allowed_file, detect_mimetype, get_s3_transfer_config, open_file_from_storage, remove_document_file_from_storage, write_file_bytes_to_storage
 from .utils import normalize_document_category, parse_bool, parse_int, row_to_dict, utcnow_iso
 from .workspace_domain import get_or_create_default_workspace_id, get_workspace_record, get_workspace_settings, normalize_workspace_settings, workspace_belongs_to_user
 
 
+PDF_SNIFF_BYTES = 1024
+_storage_write_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='storage-write')
+
+
 def get_documents():
     username = (request.args.get('username') or '').strip()
     workspace_id = (request.args.get('workspace_id') or '').strip()
@@ -345,29 +350,35 @@ def upload_file():
         return jsonify({'error': 'Filename must have an extension'}), 400
 
     unique_filename = f"{uuid.uuid4().hex}.{ext}"
-    local_filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_filename)
-    file.save(local_filepath)
+    use_s3 = bool(S3_BUCKET and s3_client)
+    local_filepath = ''
+    if not use_s3:
+        local_filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_filename)
+        file.save(local_filepath)
 
     try:
-        extracted_text, extracted_html = extract_document_content(local_filepath, ext)
-
-        try:
-            if S3_BUCKET and s3_client:
+        if use_s3:
+            # S3 is the only copy: extract from the spooled upload and stream it on, no local round-trip.
+            file_stream = file.stream
+            file_stream.seek(0)
+            extracted_text, extracted_html = extract_document_content(file_stream, ext)
+            try:
                 print(f"🚀 Uploading to S3: {S3_BUCKET}")
-                s3_client.upload_file(
-                    local_filepath,
+                file_stream.seek(0)
+                s3_client.upload_fileobj(
+                    file_stream,
                     S3_BUCKET,
                     unique_filename,
                     ExtraArgs={'ContentType': file.content_type},
+                    Config=get_s3_transfer_config(),
                 )
                 print("✅ Upload to S3 successful")
-                os.remove(local_filepath)
-                print("🗑️ Local file removed")
-            else:
-                print("⚠️ S3_BUCKET not set or client failed, keeping local file")
-        except Exception as e:
-            print(f"❌ S3 Upload Error: {e}")
-            return jsonify({'error': f'Failed to upload to S3: {str(e)}'}), 500
+            except Exception as e:
+                print(f"❌ S3 Upload Error: {e}")
+                return jsonify({'error': f'Failed to upload to S3: {str(e)}'}), 500
+        else:
+            extracted_text, extracted_html = extract_document_content(local_filepath, ext)
+            print("⚠️ S3_BUCKET not set or client failed, keeping local file")
 
         conn = get_db_connection()
         if not conn:
@@ -446,8 +457,7 @@ def get_document(doc_id):
         if not allowed:
             return jsonify({'error': reason}), 403
 
-        conn.execute('UPDATE documents SET last_access_at = ? WHERE id = ?', (datetime.utcnow().isoformat(), doc_id))
-        conn.commit()
+        queue_document_access_touch(doc_id, datetime.utcnow().isoformat())
         doc_data = dict(doc)
         workspace_id = str(doc_data.get('workspace_id') or '').strip()
         workspace_settings = get_workspace_settings(conn, workspace_id)
@@ -498,7 +508,7 @@ def delete_document(doc_id):
         if not doc:
             return jsonify({'error': 'Document not found'}), 404
 
-        owner = (doc.get('username') if hasattr(doc, 'get') else doc['username']) or ''
+        owner = doc['username'] or ''
         if owner and username != owner:
             return jsonify({'error': 'You can only delete your own documents'}), 403
 
@@ -563,11 +573,9 @@ def restore_document(doc_id):
         if not is_document_soft_deleted(doc_data):
             return jsonify({'message': 'Document is already active', 'id': doc_id, 'restored': False}), 200
 
-        conn.execute("UPDATE documents SET deleted_at = '' WHERE id = ?", (doc_id,))
-        conn.commit()
-
-        refreshed_cursor = conn.execute('SELECT * FROM documents WHERE id = ?', (doc_id,))
+        refreshed_cursor = conn.execute("UPDATE documents SET deleted_at = '' WHERE id = ? RETURNING *", (doc_id,))
         refreshed = row_to_dict(refreshed_cursor.fetchone()) or {}
+        conn.commit()
         return jsonify({
             'message': 'Document restored successfully',
             'id': doc_id,
@@ -605,16 +613,14 @@ def update_document_tags(doc_id):
         if not user_can_edit_document(conn, doc, username):
             return jsonify({'error': 'Only workspace members can edit this document'}), 403
 
-        workspace_id = str((doc.get('workspace_id') if hasattr(doc, 'get') else doc['workspace_id']) or '').strip()
+        workspace_id = str(doc['workspace_id'] or '').strip()
         workspace_settings = get_workspace_settings(conn, workspace_id)
         if not workspace_settings.get('allow_note_editing', True):
             return jsonify({'error': 'Editing is disabled in this workspace settings'}), 403
 
-        conn.execute('UPDATE documents SET tags = ? WHERE id = ?', (tags_value, doc_id))
-        conn.commit()
-
-        cursor = conn.execute('SELECT * FROM documents WHERE id = ?', (doc_id,))
+        cursor = conn.execute('UPDATE documents SET tags = ? WHERE id = ? RETURNING *', (tags_value, doc_id))
         doc = cursor.fetchone()
+        conn.commit()
         if not doc:
             return jsonify({'error': 'Document not found'}), 404
 
@@ -643,16 +649,14 @@ def update_document_category(doc_id):
         if not user_can_edit_document(conn, doc, username):
             return jsonify({'error': 'Only workspace members can edit this document'}), 403
 
-        workspace_id = str((doc.get('workspace_id') if hasattr(doc, 'get') else doc['workspace_id']) or '').strip()
+        workspace_id = str(doc['workspace_id'] or '').strip()
         workspace_settings = get_workspace_settings(conn, workspace_id)
         if not workspace_settings.get('allow_note_editing', True):
             return jsonify({'error': 'Editing is disabled in this workspace settings'}), 403
 
-        conn.execute('UPDATE documents SET category = ? WHERE id = ?', (next_category, doc_id))
-        conn.commit()
-
-        cursor = conn.execute('SELECT * FROM documents WHERE id = ?', (doc_id,))
+        cursor = conn.execute('UPDATE documents SET category = ? WHERE id = ? RETURNING *', (next_category, doc_id))
         doc = cursor.fetchone()
+        conn.commit()
         if not doc:
             return jsonify({'error': 'Document not found'}), 404
 
@@ -687,14 +691,14 @@ def update_document_content(doc_id):
         if not user_can_edit_document(conn, doc, username):
             return jsonify({'error': 'Only workspace members can edit this document'}), 403
 
-        workspace_id = str((doc.get('workspace_id') if hasattr(doc, 'get') else doc['workspace_id']) or '').strip()
+        workspace_id = str(doc['workspace_id'] or '').strip()
         workspace_settings = get_workspace_settings(conn, workspace_id)
         if not workspace_settings.get('allow_note_editing', True):
             return jsonify({'error': 'Editing is disabled in this workspace settings'}), 403
 
-        file_type = (doc.get('file_type') if hasattr(doc, 'get') else doc['file_type']) or ''
+        file_type = doc['file_type'] or ''
         file_type = str(file_type).lower().strip('.')
-        existing_html = (doc.get('content_html') if hasattr(doc, 'get') else doc['content_html']) or ''
+        existing_html = doc['content_html'] or ''
 
         if file_type in ('docx', 'txt'):
             if content_html is None:
@@ -708,7 +712,7 @@ def update_document_content(doc_id):
 
         try:
             file_bytes, mimetype = build_editable_file_bytes(file_type, content, content_html)
-            filename = doc.get('filename') if hasattr(doc, 'get') else doc['filename']
+            filename = doc['filename']
             write_file_bytes_to_storage(filename, file_bytes, mimetype)
         except ValueError as e:
             return jsonify({'error': str(e)}), 400
@@ -718,11 +722,12 @@ def update_document_content(doc_id):
             print(f"File update failed: {e}")
             return jsonify({'error': 'Failed to update source file'}), 500
 
-        conn.execute('UPDATE documents SET content = ?, content_html = ? WHERE id = ?', (content, content_html, doc_id))
-        conn.commit()
-
-        cursor = conn.execute('SELECT * FROM documents WHERE id = ?', (doc_id,))
+        cursor = conn.execute(
+            'UPDATE documents SET content = ?, content_html = ? WHERE id = ? RETURNING *',
+            (content, content_html, doc_id),
+        )
         updated_doc = cursor.fetchone()
+        conn.commit()
         return jsonify(dict(updated_doc)), 200
     finally:
         conn.close()
@@ -758,14 +763,14 @@ def import_document_text(doc_id):
         if not user_can_edit_document(conn, doc, username):
             return jsonify({'error': 'Only workspace members can save OCR results as notes'}), 403
 
-        workspace_id = str((doc.get('workspace_id') if hasattr(doc, 'get') else doc['workspace_id']) or '').strip()
+        workspace_id = str(doc['workspace_id'] or '').strip()
         workspace_settings = get_workspace_settings(conn, workspace_id)
         if not workspace_settings.get('allow_note_editing', True):
             return jsonify({'error': 'Editing is disabled in this workspace settings'}), 403
 
-        source_title = str((doc.get('title') if hasattr(doc, 'get') else doc['title']) or 'Untitled').strip()
+        source_title = str(doc['title'] or 'Untitled').strip()
         source_category = normalize_document_category(
-            (doc.get('category') if hasattr(doc, 'get') else doc['category']) or ''
+            doc['category'] or ''
         )
         note_title = custom_title or f'{source_title} OCR Note'
         content_html = sanitize_editor_html(plaintext_to_html(text))
@@ -829,7 +834,8 @@ def update_document_pdf_file(doc_id):
 
     if not file_bytes:
         return jsonify({'error': 'No PDF data provided'}), 400
-    if not file_bytes.lstrip().startswith(b'%PDF'):
+    # Only the head matters for the sniff; lstrip() on the whole payload would copy it.
+    if not file_bytes[:PDF_SNIFF_BYTES].lstrip().startswith(b'%PDF'):
         return jsonify({'error': 'Invalid PDF payload'}), 400
 
     conn = get_db_connection()
@@ -845,30 +851,38 @@ def update_document_pdf_file(doc_id):
         if not user_can_edit_document(conn, doc, username):
             return jsonify({'error': 'Only workspace members can edit this document'}), 403
 
-        workspace_id = str((doc.get('workspace_id') if hasattr(doc, 'get') else doc['workspace_id']) or '').strip()
+        workspace_id = str(doc['workspace_id'] or '').strip()
         workspace_settings = get_workspace_settings(conn, workspace_id)
         if not workspace_settings.get('allow_note_editing', True):
             return jsonify({'error': 'Editing is disabled in this workspace settings'}), 403
 
-        file_type = (doc.get('file_type') if hasattr(doc, 'get') else doc['file_type']) or ''
+        file_type = doc['file_type'] or ''
         if str(file_type).lower() != 'pdf':
             return jsonify({'error': 'This endpoint only supports PDF documents'}), 400
 
-        filename = doc.get('filename') if hasattr(doc, 'get') else doc['filename']
+        filename = doc['filename']
+        # The storage write is network-bound and text extraction is CPU-bound; run them side by side.
+        write_future = _storage_write_executor.submit(
+            write_file_bytes_to_storage,
+            filename,
+            file_bytes,
+            MIME_BY_EXT['pdf'],
+        )
+        extracted_text = extract_text_from_pdf_bytes(file_bytes)
         try:
-            write_file_bytes_to_storage(filename, file_bytes, MIME_BY_EXT['pdf'])
+            write_future.result()
         except Exception as e:
             print(f"PDF file update failed: {e}")
             return jsonify({'error': 'Failed to update source PDF file'}), 500
 
-        extracted_text = extract_text_from_pdf_bytes(file_bytes)
         if not extracted_text.strip():
-            extracted_text = (doc.get('content') if hasattr(doc, 'get') else doc['content']) or ''
-        conn.execute('UPDATE documents SET content = ?, content_html = ? WHERE id = ?', (extracted_text, '', doc_id))
-        conn.commit()
-
-        cursor = conn.execute('SELECT * FROM documents WHERE id = ?', (doc_id,))
+            extracted_text = doc['content'] or ''
+        cursor = conn.execute(
+            'UPDATE documents SET content = ?, content_html = ? WHERE id = ? RETURNING *',
+            (extracted_text, '', doc_id),
+        )
         updated_doc = cursor.fetchone()
+        conn.commit()
         return jsonify(dict(updated_doc)), 200
     finally:
         conn.close()
@@ -899,16 +913,23 @@ def get_document_file(doc_id):
         conn.close()
 
     try:
-        file_bytes = read_file_bytes_from_storage(filename)
+        file_source, file_etag, file_size = open_file_from_storage(filename)
     except FileNotFoundError:
         return jsonify({'error': 'File not found'}), 404
     except Exception as e:
         print(f"File stream error: {e}")
         return jsonify({'error': 'Could not read file from storage'}), 500
 
-    return send_file(
-        io.BytesIO(file_bytes),
+    response = send_file(
+        file_source,
         mimetype=mimetype,
         download_name=title or filename,
         as_attachment=False,
+        etag=file_etag or False,
     )
+    if response.status_code == 200 and response.content_length is None and file_size is not None:
+        # Streamed S3 bodies have no size send_file can see; HEAD already told us.
+        response.content_length = file_size
+    # Access-checked content: browsers may keep it but must revalidate (304 on a matching ETag).
+    response.cache_control.private = True
+    return response
@@ -14,3 +14,8 @@ def ocr_health():
 @ocr_bp.route('/api/extract-text/<int:doc_id>', methods=['POST'])
 def extract_text_from_image(doc_id=None):
     return shared.extract_text_from_image(doc_id)
+
+
+@ocr_bp.route('/api/extract-text/batch', methods=['POST'])
+def extract_text_from_images():
+    return shared.extract_text_from_images()
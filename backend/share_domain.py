@@ -4,6 +4,8 @@ from .config import DEFAULT_WORKSPACE_SETTINGS, INVITE_BASE_URL
 from .utils import invitation_is_expired, parse_bool, parse_int, row_to_dict, utcnow_iso
 from .workspace_domain import get_workspace_record, get_workspace_settings, normalize_workspace_settings, workspace_belongs_to_user
 
+# Share-link management only needs ownership and workspace; skip the content/content_html blobs.
+DOCUMENT_ACCESS_QUERY = 'SELECT id, username, workspace_id, deleted_at FROM documents WHERE id = ?'
 
 def is_document_soft_deleted(doc_row):
     doc = row_to_dict(doc_row) or {}
@@ -2,9 +2,10 @@ from flask import jsonify, request
 
 from .config import DEFAULT_WORKSPACE_SETTINGS
 from .db import get_db_connection
-from .document_domain import plaintext_to_html
+from .document_domain import plaintext_to_html, queue_document_access_touch
 from .utils import parse_bool, parse_int, row_to_dict, utcnow_iso
 from .share_domain import (
+    DOCUMENT_ACCESS_QUERY,
     check_document_access,
     count_active_document_share_links,
     create_document_share_token,
@@ -29,7 +30,7 @@ def create_document_share_link(doc_id):
         return jsonify({'error': 'Database connection failed'}), 500
 
     try:
-        cursor = conn.execute('SELECT * FROM documents WHERE id = ?', (doc_id,))
+        cursor = conn.execute(DOCUMENT_ACCESS_QUERY, (doc_id,))
         doc = cursor.fetchone()
         if not doc:
             return jsonify({'error': 'Document not found'}), 404
@@ -140,7 +141,7 @@ def list_document_share_links(doc_id):
     if not conn:
         return jsonify({'error': 'Database connection failed'}), 500
     try:
-        cursor = conn.execute('SELECT * FROM documents WHERE id = ?', (doc_id,))
+        cursor = conn.execute(DOCUMENT_ACCESS_QUERY, (doc_id,))
         doc = cursor.fetchone()
         if not doc:
             return jsonify({'error': 'Document not found'}), 404
@@ -172,7 +173,7 @@ def revoke_all_document_share_links(doc_id):
     if not conn:
         return jsonify({'error': 'Database connection failed'}), 500
     try:
-        cursor = conn.execute('SELECT * FROM documents WHERE id = ?', (doc_id,))
+        cursor = conn.execute(DOCUMENT_ACCESS_QUERY, (doc_id,))
         doc = cursor.fetchone()
         if not doc:
             return jsonify({'error': 'Document not found'}), 404
@@ -222,7 +223,7 @@ def revoke_document_share_link(doc_id, share_link_id):
     if not conn:
         return jsonify({'error': 'Database connection failed'}), 500
     try:
-        cursor = conn.execute('SELECT * FROM documents WHERE id = ?', (doc_id,))
+        cursor = conn.execute(DOCUMENT_ACCESS_QUERY, (doc_id,))
         doc = cursor.fetchone()
         if not doc:
             return jsonify({'error': 'Document not found'}), 404
@@ -271,7 +272,7 @@ def delete_document_share_link(doc_id, share_link_id):
     if not conn:
         return jsonify({'error': 'Database connection failed'}), 500
     try:
-        cursor = conn.execute('SELECT * FROM documents WHERE id = ?', (doc_id,))
+        cursor = conn.execute(DOCUMENT_ACCESS_QUERY, (doc_id,))
         doc = cursor.fetchone()
         if not doc:
             return jsonify({'error': 'Document not found'}), 404
@@ -313,7 +314,7 @@ def delete_inactive_document_share_links(doc_id):
     if not conn:
         return jsonify({'error': 'Database connection failed'}), 500
     try:
-        cursor = conn.execute('SELECT * FROM documents WHERE id = ?', (doc_id,))
+        cursor = conn.execute(DOCUMENT_ACCESS_QUERY, (doc_id,))
         doc = cursor.fetchone()
         if not doc:
             return jsonify({'error': 'Document not found'}), 404
@@ -418,11 +419,7 @@ def get_document_by_share_token(token):
         )
         refreshed_share_row = row_to_dict(refreshed_share_cursor.fetchone()) or share_row
 
-        conn.execute(
-            'UPDATE documents SET last_access_at = ? WHERE id = ?',
-            (utcnow_iso(), doc_id),
-        )
-        conn.commit()
+        queue_document_access_touch(doc_id, utcnow_iso())
 
         doc_data = dict(doc)
         workspace_id = str(doc_data.get('workspace_id') or '').strip()
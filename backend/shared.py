@@ -2,23 +2,32 @@ import os
 import io
 import sys
 import json
+import functools
 import hashlib
 import re
-import shutil
 import subprocess
 import tempfile
+import threading
+import time
 import uuid
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+import orjson
 import requests
+from cachetools import TTLCache
 from datetime import datetime, timedelta
-from flask import request, jsonify, send_from_directory, redirect
+from flask import Response, request, jsonify, send_from_directory, redirect
+from flask.json.provider import DefaultJSONProvider
 from werkzeug.security import generate_password_hash, check_password_hash
-from sklearn.feature_extraction.text import TfidfVectorizer
 
 # --- Google 登录库 ---
 from google.oauth2 import id_token
 from google.auth.transport import requests as google_requests
 
 from .config import (
+    ANALYSIS_MEMO_MAX_ITEMS,
+    ANALYSIS_MEMO_TTL_SECONDS,
+    ANALYZE_TEXT_MAX_CHARS,
     DEFAULT_WORKSPACE_SETTINGS,
     ENABLE_PDF_OCR_FALLBACK,
     EXTERNAL_OCR_SERVICE_URL,
@@ -28,10 +37,14 @@ from .config import (
     HF_TOKEN,
     OCR_MODEL_ID,
     OCRMYPDF_BINARY,
+    OCRMYPDF_JOBS,
     OCRMYPDF_LANGUAGE,
     OCRMYPDF_TIMEOUT_SECONDS,
+    OCR_MEMO_MAX_ITEMS,
+    OCR_MEMO_TTL_SECONDS,
     S3_BUCKET,
     SUMMARY_CACHE_VERSION,
+    SUMMARY_MIN_WORDS,
     SUMMARIZER_MODEL_ID,
     WORKSPACE_SUMMARY_LENGTH_LEVELS,
     s3_client,
@@ -40,8 +53,14 @@ from .db import get_db_connection
 from .document_domain import (
     extract_document_content,
     extract_text_from_pdf_bytes_with_meta,
+    get_local_ocr_engine,
+    is_local_ocr_engine_ready,
+    is_local_ocr_supported,
+    get_ocrmypdf_path,
     normalize_newlines,
     plaintext_to_html,
+    run_local_ocr_on_image_bytes,
+    shrink_image_for_remote_ocr,
     user_can_edit_document,
 )
 from .security import create_auth_token, decode_auth_token, get_bearer_token
@@ -51,9 +70,11 @@ from .share_domain import (
 )
 from .storage import (
     detect_mimetype,
+    get_presigned_download,
     read_file_bytes_from_storage,
 )
 from .utils import (
+    http_session,
     parse_bool,
     parse_float,
     parse_int,
@@ -69,13 +90,88 @@ from .workspace_domain import (
 
 # ================= 配置部分 =================
 app = None
+static_files = frozenset()
+STATIC_ASSET_MAX_AGE_SECONDS = 365 * 24 * 3600
+STATIC_FILE_MAX_AGE_SECONDS = 24 * 3600
+# The default summarizer (bart-large-cnn) accepts 1024 positions; leave room for special tokens.
+SUMMARY_MAX_INPUT_TOKENS = 1000
+
+# In-process memo of model summaries, shared by every caller that submits the same text.
+_analysis_memo = TTLCache(maxsize=ANALYSIS_MEMO_MAX_ITEMS, ttl=ANALYSIS_MEMO_TTL_SECONDS)
+_analysis_memo_lock = threading.Lock()
+
+# OCR text by image SHA-256; in-flight runs are shared so duplicate uploads wait instead of re-running.
+_ocr_memo = TTLCache(maxsize=OCR_MEMO_MAX_ITEMS, ttl=OCR_MEMO_TTL_SECONDS)
+_ocr_inflight = {}
+_ocr_memo_lock = threading.Lock()
+
+OCR_BATCH_MAX_IMAGES = 16
+_ocr_batch_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='ocr-batch')
+
+# Same tokenisation as sklearn's CountVectorizer default (lowercased, 2+ word characters).
+_RE_KEYWORD_TOKEN = re.compile(r'\b\w\w+\b')
+_RE_WHITESPACE = re.compile(r'\s+')
+_RE_INLINE_SPACES = re.compile(r'[ \t]+')
+_RE_LINE_BREAKS = re.compile(r'\n+')
+_RE_SENTENCE_BREAK = re.compile(r'(?<=[.!?。！？])\s+')
+_RE_SENTENCE_OR_LINE_BREAK = re.compile(r'(?<=[.!?。！？])\s+|\n+')
+_RE_PART_PREFIX = re.compile(r'(?im)^\s*part\s+\d+\s*:\s*')
+_keyword_stop_words = None
+
+# (open_until, error): HF answers 403/404/410 when the OCR model isn't served; stop asking for a while.
+HF_OCR_BREAKER_SECONDS = 600
+HF_OCR_BREAKER_STATUSES = frozenset((403, 404, 410))
+_hf_ocr_breaker = (0.0, '')
+
+
+def _hf_ocr_breaker_error():
+    """Return the cached HF OCR error while the breaker is open, else ''."""
+    open_until, error = _hf_ocr_breaker
+    remaining = int(open_until - time.monotonic())
+    if remaining > 0:
+        return f"{error} (cached; HF OCR is retried in {remaining}s)"
+    return ''
+
+
+def _set_hf_ocr_breaker(error=''):
+    """Open the breaker with the given error, or close it when error is empty."""
+    global _hf_ocr_breaker
+    _hf_ocr_breaker = (time.monotonic() + HF_OCR_BREAKER_SECONDS, error) if error else (0.0, '')
 
 
 # ================= 辅助函数 =================
 
 
+class OrjsonJSONProvider(DefaultJSONProvider):
+    # datetime 仍交给 Flask 的 default 处理，保持与 jsonify 原来的输出格式一致
+    option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self.option).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default, option=self.option)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def build_static_file_set(static_root):
+    root = str(static_root or '')
+    if not root or not os.path.isdir(root):
+        return frozenset()
+    collected = set()
+    for dir_path, _, file_names in os.walk(root):
+        for file_name in file_names:
+            rel_path = os.path.relpath(os.path.join(dir_path, file_name), root)
+            collected.add(rel_path.replace(os.sep, '/'))
+    return frozenset(collected)
+
+
 def build_summary_cache_text_hash(text):
-    normalized = re.sub(r'\s+', ' ', str(text or '').strip())
+    normalized = _RE_WHITESPACE.sub(' ', str(text or '').strip())
     if not normalized:
         return ''
     payload = f"{SUMMARY_CACHE_VERSION}:{normalized}"
@@ -202,6 +298,31 @@ def save_document_summary_cache(
         return False
 
 
+def load_memoized_analysis(content_hash, summary_length, keyword_limit):
+    if not content_hash:
+        return None
+    key = (content_hash, str(summary_length or '').strip().lower(), parse_int(keyword_limit, 5, 1))
+    with _analysis_memo_lock:
+        cached = _analysis_memo.get(key)
+    return dict(cached) if cached else None
+
+
+def save_memoized_analysis(content_hash, summary_length, keyword_limit, summary_result, keywords):
+    if not content_hash or not isinstance(summary_result, dict):
+        return
+    # Only model output is worth sharing; fallback summaries should retry HF next time.
+    if summary_result.get('summary_source') != 'huggingface':
+        return
+    if not str(summary_result.get('summary') or '').strip():
+        return
+    key = (content_hash, str(summary_length or '').strip().lower(), parse_int(keyword_limit, 5, 1))
+    with _analysis_memo_lock:
+        _analysis_memo[key] = {
+            **summary_result,
+            'keywords': list(keywords or []),
+        }
+
+
 # ================= API 路由接口 =================
 
 def register():
@@ -238,18 +359,17 @@ def login():
     password = data.get('password')
 
     conn = get_db_connection()
-    cursor = conn.execute('SELECT * FROM users WHERE username = ? OR email = ?', 
+    cursor = conn.execute('SELECT username, email, password_hash FROM users WHERE username = ? OR email = ?',
                         (username_or_email, username_or_email))
-    user = cursor.fetchone()
+    user = row_to_dict(cursor.fetchone())
     conn.close()
 
     if user and check_password_hash(user['password_hash'], password):
-        user_email = user.get('email') if hasattr(user, 'get') else user['email']
         auth_token = create_auth_token(user['username'])
         return jsonify({
             'message': 'Login successful',
             'username': user['username'],
-            'email': user_email,
+            'email': user.get('email'),
             'auth_token': auth_token,
         }), 200
     else:
@@ -270,12 +390,12 @@ def me():
             'SELECT username, email FROM users WHERE username = ?',
             (token_username,),
         )
-        user = cursor.fetchone()
+        user = row_to_dict(cursor.fetchone())
         if not user:
             return jsonify({'error': 'User account not found for this session'}), 404
         return jsonify({
             'username': user['username'],
-            'email': user.get('email') if hasattr(user, 'get') else user['email'],
+            'email': user.get('email'),
             'authenticated': True,
         }), 200
     finally:
@@ -304,8 +424,8 @@ def google_login():
         name = id_info.get('name', email.split('@')[0])
         
         conn = get_db_connection()
-        cursor = conn.execute('SELECT * FROM users WHERE email = ?', (email,))
-        user = cursor.fetchone()
+        cursor = conn.execute('SELECT username, email FROM users WHERE email = ?', (email,))
+        user = row_to_dict(cursor.fetchone())
         
         if user is None:
             username = f"{name.split()[0]}_{uuid.uuid4().hex[:4]}"
@@ -315,18 +435,16 @@ def google_login():
                 conn.execute('INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)',
                              (username, email, hashed_password))
                 conn.commit()
-                cursor = conn.execute('SELECT * FROM users WHERE email = ?', (email,))
-                user = cursor.fetchone()
+                user = {'username': username, 'email': email}
             except Exception as e:
                 conn.close()
                 return jsonify({'error': f'Register failed: {str(e)}'}), 500
         conn.close()
-        user_email = user.get('email') if hasattr(user, 'get') else user['email']
         auth_token = create_auth_token(user['username'])
         return jsonify({
             'message': 'Login successful',
             'username': user['username'],
-            'email': user_email,
+            'email': user.get('email'),
             'auth_token': auth_token,
         }), 200
     except ValueError:
@@ -337,7 +455,7 @@ def google_login():
 
 def extract_key_sentences(text_content, keywords=None, limit=3):
     normalized = normalize_newlines(text_content or '')
-    fragments = [part.strip() for part in re.split(r'(?<=[.!?。！？])\s+', normalized) if part.strip()]
+    fragments = [part.strip() for part in _RE_SENTENCE_BREAK.split(normalized) if part.strip()]
     if not fragments:
         return []
 
@@ -370,15 +488,18 @@ def extract_key_sentences(text_content, keywords=None, limit=3):
         top = fragments[:max(1, int(limit or 3))]
     return top
 
+_HF_AUTH_HEADERS = {"Authorization": f"Bearer {HF_TOKEN}"} if HF_TOKEN else None
+
+
 def get_hf_headers(content_type=None):
-    if not HF_TOKEN:
+    if not _HF_AUTH_HEADERS:
         return None
-    result = {"Authorization": f"Bearer {HF_TOKEN}"}
     if content_type:
-        result["Content-Type"] = content_type
-    return result
+        return {**_HF_AUTH_HEADERS, "Content-Type": content_type}
+    return dict(_HF_AUTH_HEADERS)
 
 
+@functools.lru_cache(maxsize=16)
 def hf_model_url(model_id):
     return f"{HF_MODEL_BASE_URL}/{model_id}"
 
@@ -412,9 +533,25 @@ def hf_error_message(response):
     return raw_text[:240] or 'Unknown error'
 
 
+def estimate_summary_tokens(text):
+    # Byte-level BPE: English runs about 4 chars/token, while CJK and other non-ASCII
+    # characters usually cost 2+ tokens each.
+    value = str(text or '')
+    ascii_chars = len(value.encode('ascii', 'ignore'))
+    return ascii_chars // 4 + (len(value) - ascii_chars) * 2
+
+
+def fit_chars_to_token_budget(text, max_chars):
+    """Shrink a character budget so a slice of `text` stays within SUMMARY_MAX_INPUT_TOKENS."""
+    estimate = estimate_summary_tokens(str(text or '')[:max_chars])
+    if estimate <= SUMMARY_MAX_INPUT_TOKENS:
+        return max_chars
+    return max(300, int(max_chars * SUMMARY_MAX_INPUT_TOKENS / estimate))
+
+
 def split_text_for_summary(text_content, max_chars=3600, min_chars=1200, overlap_chars=220):
     normalized = normalize_newlines(text_content or '')
-    normalized = re.sub(r'[ \t]+', ' ', normalized).strip()
+    normalized = _RE_INLINE_SPACES.sub(' ', normalized).strip()
     if not normalized:
         return []
     if len(normalized) <= max_chars:
@@ -475,26 +612,26 @@ def split_text_for_summary(text_content, max_chars=3600, min_chars=1200, overlap
 
 def build_fallback_summary(text_content, sentence_limit=3, max_chars=560):
     raw_text = normalize_newlines(text_content or '')
-    raw_text = re.sub(r'(?im)^\s*part\s+\d+\s*:\s*', '', raw_text)
-    raw_text = re.sub(r'[ \t]+', ' ', raw_text).strip()
+    raw_text = _RE_PART_PREFIX.sub('', raw_text)
+    raw_text = _RE_INLINE_SPACES.sub(' ', raw_text).strip()
     if not raw_text:
         return ''
 
     safe_limit = max(1, int(sentence_limit or 3))
     fragments = [
         part.strip()
-        for part in re.split(r'(?<=[.!?。！？])\s+|\n+', raw_text)
+        for part in _RE_SENTENCE_OR_LINE_BREAK.split(raw_text)
         if part.strip()
     ]
 
     if len(fragments) < safe_limit:
         compact_lines = [
             part.strip()
-            for part in re.split(r'\n+', normalize_newlines(text_content or ''))
+            for part in _RE_LINE_BREAKS.split(normalize_newlines(text_content or ''))
             if part.strip()
         ]
         for item in compact_lines:
-            candidate = re.sub(r'\s+', ' ', item)
+            candidate = _RE_WHITESPACE.sub(' ', item)
             if candidate and candidate not in fragments:
                 fragments.append(candidate)
 
@@ -549,6 +686,11 @@ def call_hf_summarizer_once(text_content, length_options):
     if not hf_headers:
         return {'ok': False, 'summary': '', 'error': 'HF_API_TOKEN is not configured on server.'}
 
+    # Past the model's position limit HF either truncates server-side or rejects the request.
+    input_chars = fit_chars_to_token_budget(safe_text, len(safe_text))
+    if input_chars < len(safe_text):
+        safe_text = safe_text[:input_chars].rstrip()
+
     payload = {
         "inputs": safe_text,
         "parameters": {
@@ -560,7 +702,7 @@ def call_hf_summarizer_once(text_content, length_options):
     }
 
     try:
-        response = requests.post(
+        response = http_session.post(
             hf_model_url(SUMMARIZER_MODEL_ID),
             headers=hf_headers,
             json=payload,
@@ -604,10 +746,11 @@ def summarize_text_with_chunk_merge(text_content, length_options):
     safe_text = str(text_content or '').strip()
     sentence_limit = max(1, int((length_options or {}).get('sentence_limit', 3) or 3))
     hf_available = bool(get_hf_headers('application/json'))
+    chunk_chars = fit_chars_to_token_budget(safe_text, 3600)
     chunks = split_text_for_summary(
         safe_text,
-        max_chars=3600,
-        min_chars=1200,
+        max_chars=chunk_chars,
+        min_chars=chunk_chars // 3,
         overlap_chars=220
     )
 
@@ -619,6 +762,20 @@ def summarize_text_with_chunk_merge(text_content, length_options):
             'meta': {'chunk_count': 0, 'merge_rounds': 0}
         }
 
+    # Very short inputs do not benefit from the model; skip the HF round-trip.
+    if len(safe_text.split()) < SUMMARY_MIN_WORDS:
+        return {
+            'summary': build_fallback_summary(safe_text, sentence_limit=sentence_limit, max_chars=560),
+            'summary_source': 'fallback',
+            'summary_note': f'Short input (< {SUMMARY_MIN_WORDS} words) summarized locally',
+            'meta': {
+                'chunk_count': len(chunks),
+                'merge_rounds': 0,
+                'hf_success_count': 0,
+                'fallback_count': 1,
+            }
+        }
+
     hf_success_count = 0
     fallback_count = 0
     error_samples = []
@@ -662,10 +819,11 @@ def summarize_text_with_chunk_merge(text_content, length_options):
             ).strip()
             if not combined_text:
                 break
+            merge_chars = fit_chars_to_token_budget(combined_text, 3400)
             merge_chunks = split_text_for_summary(
                 combined_text,
-                max_chars=3400,
-                min_chars=900,
+                max_chars=merge_chars,
+                min_chars=min(900, merge_chars // 3),
                 overlap_chars=120
             )
             if not merge_chunks:
@@ -770,8 +928,10 @@ def normalize_ocr_text(payload, depth=0):
 
 
 def get_ocr_runtime_status():
-    ocrmypdf_path = shutil.which(OCRMYPDF_BINARY)
+    ocrmypdf_path = get_ocrmypdf_path()
     status = {
+        'local_ocr_available': is_local_ocr_supported(),
+        'local_engine_ready': is_local_ocr_engine_ready(),
         'external_ocr_configured': bool(EXTERNAL_OCR_SERVICE_URL),
         'external_ocr_service_url': EXTERNAL_OCR_SERVICE_URL,
         'external_ocr_timeout_seconds': EXTERNAL_OCR_TIMEOUT_SECONDS,
@@ -783,9 +943,14 @@ def get_ocr_runtime_status():
         'ocrmypdf_available': bool(ocrmypdf_path),
         'ocrmypdf_path': ocrmypdf_path or '',
         'ocrmypdf_language': OCRMYPDF_LANGUAGE,
+        'ocrmypdf_jobs': OCRMYPDF_JOBS,
         'hints': [],
     }
 
+    if status['local_engine_ready']:
+        status['hints'].append('Local RapidOCR engine is loaded and will be tried before remote providers.')
+    elif status['local_ocr_available']:
+        status['hints'].append('Local RapidOCR engine will load on first OCR request; set PRELOAD_LOCAL_OCR=1 to load it at startup.')
     if not status['external_ocr_configured'] and not status['hf_token_configured']:
         status['hints'].append('Set HF_API_TOKEN in environment variables to enable Hugging Face OCR.')
     if status['external_ocr_configured']:
@@ -798,7 +963,11 @@ def get_ocr_runtime_status():
 
 def ocr_health():
     status = get_ocr_runtime_status()
-    ok = bool(status.get('external_ocr_configured') or status.get('hf_token_configured'))
+    ok = bool(
+        status.get('local_ocr_available')
+        or status.get('external_ocr_configured')
+        or status.get('hf_token_configured')
+    )
     status['ok'] = ok
     status['checked_at'] = utcnow_iso()
     if not ok:
@@ -877,7 +1046,7 @@ def call_external_ocr_service(img_bytes, mimetype='application/octet-stream', so
     attempt_errors = []
     for attempt_name, request_kwargs in attempts:
         try:
-            response = requests.post(
+            response = http_session.post(
                 endpoint,
                 timeout=EXTERNAL_OCR_TIMEOUT_SECONDS,
                 **request_kwargs,
@@ -925,108 +1094,98 @@ def call_external_ocr_service(img_bytes, mimetype='application/octet-stream', so
 # 专家 1 号：视觉专家 (负责看图识字)
 # 对应前端的【按钮 1】
 # ==========================================
-def extract_text_from_image(doc_id=None):
-    username = (request.values.get('username') or '').strip()
-    share_token = (request.values.get('share_token') or '').strip()
-    requested_workspace_id = (request.values.get('workspace_id') or '').strip()
-    img_bytes = b''
-    mimetype = 'application/octet-stream'
-    source_filename = 'image.jpg'
-
-    if doc_id is not None:
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({'error': 'Database connection failed'}), 500
-        doc = None
-        workspace_settings = dict(DEFAULT_WORKSPACE_SETTINGS)
-        try:
-            cursor = conn.execute('SELECT * FROM documents WHERE id = ?', (doc_id,))
-            doc = cursor.fetchone()
-            if doc:
-                allowed, reason = check_document_access(conn, doc, username, share_token)
-                if not allowed:
-                    return jsonify({"error": reason}), 403
-
-                workspace_id = str(
-                    (doc.get('workspace_id') if hasattr(doc, 'get') else doc['workspace_id']) or ''
-                ).strip()
-                workspace_settings = get_workspace_settings(conn, workspace_id)
-        finally:
-            conn.close()
-
-        if not doc:
-            return jsonify({"error": "Document not found"}), 404
-        if not workspace_settings.get('allow_ai_tools', True):
-            return jsonify({"error": "AI tools are disabled in this workspace settings"}), 403
-        if not workspace_settings.get('allow_ocr', True):
-            return jsonify({"error": "OCR is disabled in this workspace settings"}), 403
-
-        filename = doc.get('filename') if hasattr(doc, 'get') else doc['filename']
-        file_type = doc.get('file_type') if hasattr(doc, 'get') else doc['file_type']
-        source_filename = str(filename or source_filename)
-        if str(file_type or '').lower() not in ('png', 'jpg', 'jpeg', 'webp', 'gif'):
-            return jsonify({"error": "This endpoint only supports image documents"}), 400
-        mimetype = detect_mimetype(filename, file_type)
-
-        try:
-            if S3_BUCKET and s3_client:
-                s3_obj = s3_client.get_object(Bucket=S3_BUCKET, Key=filename)
-                img_bytes = s3_obj['Body'].read()
-            else:
-                local_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                if not os.path.exists(local_path):
-                    return jsonify({"error": "Source image not found"}), 404
-                with open(local_path, 'rb') as f:
-                    img_bytes = f.read()
-        except Exception as e:
-            return jsonify({"error": f"Failed to read source image: {e}"}), 500
-    else:
-        if username:
-            conn = get_db_connection()
-            if not conn:
-                return jsonify({'error': 'Database connection failed'}), 500
-            try:
-                workspace_id = requested_workspace_id
-                if not workspace_id:
-                    default_cursor = conn.execute(
-                        '''
-                        SELECT id
-                        FROM workspaces
-                        WHERE owner_username = ?
-                        ORDER BY created_at ASC, id ASC
-                        LIMIT 1
-                        ''',
-                        (username,)
-                    )
-                    default_row = row_to_dict(default_cursor.fetchone())
-                    workspace_id = str(default_row.get('id') or '').strip()
-                if workspace_id and not workspace_belongs_to_user(conn, workspace_id, username):
-                    return jsonify({'error': 'No access to this workspace'}), 403
-                workspace_settings = get_workspace_settings(conn, workspace_id)
-            finally:
-                conn.close()
+def check_upload_ocr_allowed(username, requested_workspace_id=''):
+    """Return an error response when workspace settings forbid OCR on uploaded images, else None."""
+    if not username:
+        return None
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'error': 'Database connection failed'}), 500
+    try:
+        workspace_id = requested_workspace_id
+        if not workspace_id:
+            default_cursor = conn.execute(
+                '''
+                SELECT id
+                FROM workspaces
+                WHERE owner_username = ?
+                ORDER BY created_at ASC, id ASC
+                LIMIT 1
+                ''',
+                (username,)
+            )
+            default_row = row_to_dict(default_cursor.fetchone())
+            workspace_id = str(default_row.get('id') or '').strip()
+        if workspace_id and not workspace_belongs_to_user(conn, workspace_id, username):
+            return jsonify({'error': 'No access to this workspace'}), 403
+        workspace_settings = get_workspace_settings(conn, workspace_id)
+    finally:
+        conn.close()
 
-            if not workspace_settings.get('allow_ai_tools', True):
-                return jsonify({"error": "AI tools are disabled in this workspace settings"}), 403
-            if not workspace_settings.get('allow_ocr', True):
-                return jsonify({"error": "OCR is disabled in this workspace settings"}), 403
+    if not workspace_settings.get('allow_ai_tools', True):
+        return jsonify({"error": "AI tools are disabled in this workspace settings"}), 403
+    if not workspace_settings.get('allow_ocr', True):
+        return jsonify({"error": "OCR is disabled in this workspace settings"}), 403
+    return None
+
+
+def run_image_ocr(img_bytes, mimetype='application/octet-stream', source_filename='image.jpg'):
+    """OCR an image, reusing the result for identical bytes; returns (payload, status)."""
+    image_hash = hashlib.sha256(img_bytes).hexdigest()
+    with _ocr_memo_lock:
+        cached = _ocr_memo.get(image_hash)
+        if cached is not None:
+            return dict(cached), 200
+        inflight = _ocr_inflight.get(image_hash)
+        if inflight is None:
+            owner = Future()
+            _ocr_inflight[image_hash] = owner
+    if inflight is not None:
+        return inflight.result()
 
-        if 'image' not in request.files:
-            return jsonify({"error": "No image provided"}), 400
-        file = request.files['image']
-        mimetype = file.mimetype or 'application/octet-stream'
-        source_filename = str(file.filename or source_filename)
-        img_bytes = file.read()
+    try:
+        payload, status = run_image_ocr_chain(img_bytes, mimetype, source_filename)
+    except BaseException as e:
+        with _ocr_memo_lock:
+            _ocr_inflight.pop(image_hash, None)
+        owner.set_exception(e)
+        raise
+    with _ocr_memo_lock:
+        # Failures are not cached so a provider that recovers is tried again.
+        if status == 200:
+            _ocr_memo[image_hash] = dict(payload)
+        _ocr_inflight.pop(image_hash, None)
+    owner.set_result((payload, status))
+    return payload, status
+
+
+def run_image_ocr_chain(img_bytes, mimetype='application/octet-stream', source_filename='image.jpg'):
+    """Run the local -> external -> Hugging Face OCR chain; returns (payload, status)."""
+    if get_local_ocr_engine() is not None:
+        local_ok, local_text, local_error = run_local_ocr_on_image_bytes(img_bytes)
+        if local_ok and local_text:
+            return {"text": local_text, "source": "local"}, 200
+        print(
+            "OCR provider failure:",
+            json.dumps(
+                {
+                    "provider": "local",
+                    "filename": source_filename,
+                    "message": local_error,
+                },
+                ensure_ascii=False,
+            ),
+        )
 
-    if not img_bytes:
-        return jsonify({"error": "Empty image file"}), 400
+    # Remote providers get a downscaled JPEG; upload time dominates for phone photos.
+    remote_img_bytes, remote_mimetype = shrink_image_for_remote_ocr(img_bytes, mimetype)
 
     external_error = ''
     external_endpoint = str(EXTERNAL_OCR_SERVICE_URL or '').strip()
     if external_endpoint:
         external_ok, external_text, external_error = call_external_ocr_service(
-            img_bytes,
-            mimetype=mimetype,
+            remote_img_bytes,
+            mimetype=remote_mimetype,
             source_filename=source_filename,
         )
         if external_ok and external_text:
@@ -1041,7 +1200,7 @@ def extract_text_from_image(doc_id=None):
                     ensure_ascii=False,
                 ),
             )
-            return jsonify({"text": external_text, "source": "external"})
+            return {"text": external_text, "source": "external"}, 200
         print(
             "OCR provider failure:",
             json.dumps(
@@ -1056,23 +1215,29 @@ def extract_text_from_image(doc_id=None):
         )
 
     hf_error = ''
-    hf_headers = get_hf_headers(mimetype or 'application/octet-stream')
-    if hf_headers:
+    hf_headers = get_hf_headers(remote_mimetype or 'application/octet-stream')
+    breaker_error = _hf_ocr_breaker_error()
+    if hf_headers and breaker_error:
+        hf_error = breaker_error
+    elif hf_headers:
         try:
             target_url = hf_model_url(OCR_MODEL_ID)
-            response = requests.post(target_url, headers=hf_headers, data=img_bytes, timeout=90)
+            response = http_session.post(target_url, headers=hf_headers, data=remote_img_bytes, timeout=90)
             if response.status_code < 400:
+                _set_hf_ocr_breaker()
                 try:
                     ocr_result = response.json()
                     extracted_text = normalize_ocr_text(ocr_result)
 
                     if extracted_text:
-                        return jsonify({"text": extracted_text, "source": "huggingface"})
+                        return {"text": extracted_text, "source": "huggingface"}, 200
                     hf_error = "HF OCR returned empty text"
                 except Exception:
                     hf_error = f"HF OCR returned non-JSON response: {hf_error_message(response)}"
             else:
                 hf_error = f"HF OCR failed ({response.status_code}): {hf_error_message(response)}"
+                if response.status_code in HF_OCR_BREAKER_STATUSES:
+                    _set_hf_ocr_breaker(hf_error)
                 print(
                     "OCR provider failure:",
                     json.dumps(
@@ -1117,7 +1282,7 @@ def extract_text_from_image(doc_id=None):
         error_text = f"{external_error} | {hf_error}"
     else:
         error_text = hf_error
-    return jsonify({
+    return {
         "error": f"OCR failed: {error_text}" if error_text else "OCR failed",
         "details": {
             "external": external_error,
@@ -1125,13 +1290,125 @@ def extract_text_from_image(doc_id=None):
             "runtime": runtime_status,
             "hint": "Configure EXTERNAL_OCR_SERVICE_URL or a valid Hugging Face OCR model to enable OCR."
         }
-    }), 502
+    }, 502
+
+
+def extract_text_from_image(doc_id=None):
+    username = (request.values.get('username') or '').strip()
+    share_token = (request.values.get('share_token') or '').strip()
+    requested_workspace_id = (request.values.get('workspace_id') or '').strip()
+    img_bytes = b''
+    mimetype = 'application/octet-stream'
+    source_filename = 'image.jpg'
+
+    if doc_id is not None:
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'error': 'Database connection failed'}), 500
+        doc = None
+        workspace_settings = dict(DEFAULT_WORKSPACE_SETTINGS)
+        try:
+            cursor = conn.execute('SELECT * FROM documents WHERE id = ?', (doc_id,))
+            doc = cursor.fetchone()
+            if doc:
+                allowed, reason = check_document_access(conn, doc, username, share_token)
+                if not allowed:
+                    return jsonify({"error": reason}), 403
+
+                workspace_id = str(doc['workspace_id'] or '').strip()
+                workspace_settings = get_workspace_settings(conn, workspace_id)
+        finally:
+            conn.close()
+
+        if not doc:
+            return jsonify({"error": "Document not found"}), 404
+        if not workspace_settings.get('allow_ai_tools', True):
+            return jsonify({"error": "AI tools are disabled in this workspace settings"}), 403
+        if not workspace_settings.get('allow_ocr', True):
+            return jsonify({"error": "OCR is disabled in this workspace settings"}), 403
+
+        filename = doc['filename']
+        file_type = doc['file_type']
+        source_filename = str(filename or source_filename)
+        if str(file_type or '').lower() not in ('png', 'jpg', 'jpeg', 'webp', 'gif'):
+            return jsonify({"error": "This endpoint only supports image documents"}), 400
+        mimetype = detect_mimetype(filename, file_type)
+
+        try:
+            # Shares the S3 object cache with file downloads, so re-running OCR skips the GET.
+            img_bytes = read_file_bytes_from_storage(filename)
+        except FileNotFoundError:
+            return jsonify({"error": "Source image not found"}), 404
+        except Exception as e:
+            return jsonify({"error": f"Failed to read source image: {e}"}), 500
+    else:
+        denied = check_upload_ocr_allowed(username, requested_workspace_id)
+        if denied:
+            return denied
+
+        if 'image' not in request.files:
+            return jsonify({"error": "No image provided"}), 400
+        file = request.files['image']
+        mimetype = file.mimetype or 'application/octet-stream'
+        source_filename = str(file.filename or source_filename)
+        img_bytes = file.read()
+
+    if not img_bytes:
+        return jsonify({"error": "Empty image file"}), 400
+
+    payload, status = run_image_ocr(img_bytes, mimetype, source_filename)
+    return jsonify(payload), status
+
+
+def extract_text_from_images():
+    username = (request.values.get('username') or '').strip()
+    requested_workspace_id = (request.values.get('workspace_id') or '').strip()
+    denied = check_upload_ocr_allowed(username, requested_workspace_id)
+    if denied:
+        return denied
+
+    files = request.files.getlist('images')
+    if not files:
+        return jsonify({"error": "No images provided"}), 400
+    if len(files) > OCR_BATCH_MAX_IMAGES:
+        return jsonify({"error": f"At most {OCR_BATCH_MAX_IMAGES} images per request"}), 400
+
+    jobs = []
+    for file in files:
+        source_filename = str(file.filename or 'image.jpg')
+        img_bytes = file.read()
+        if not img_bytes:
+            jobs.append((source_filename, None))
+            continue
+        mimetype = file.mimetype or 'application/octet-stream'
+        # Each image runs its own provider chain; the remote calls overlap across images.
+        jobs.append((source_filename, _ocr_batch_executor.submit(run_image_ocr, img_bytes, mimetype, source_filename)))
+
+    results = []
+    for source_filename, future in jobs:
+        if future is None:
+            results.append({"filename": source_filename, "error": "Empty image file"})
+            continue
+        payload, _ = future.result()
+        results.append({"filename": source_filename, **payload})
+    return jsonify({"results": results})
 
 
 # ==========================================
 # 专家 2 号：语言专家 (负责摘要和提取关键词)
 # 对应前端的【按钮 2】
 # ==========================================
+
+def get_keyword_stop_words():
+    global _keyword_stop_words
+    if _keyword_stop_words is None:
+        # Imported on first use so workers that never summarize skip loading sklearn.
+        from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+
+        _keyword_stop_words = frozenset(ENGLISH_STOP_WORDS)
+    return _keyword_stop_words
+
+
 def analyze_text():
     data = request.get_json(silent=True) or {}
     username = str(data.get('username') or '').strip()
@@ -1165,22 +1442,12 @@ def analyze_text():
             if not allowed:
                 return jsonify({'error': reason}), 403
 
-            workspace_id = str(
-                (doc.get('workspace_id') if hasattr(doc, 'get') else doc['workspace_id']) or ''
-            ).strip()
+            workspace_id = str(doc['workspace_id'] or '').strip()
             workspace_settings = get_workspace_settings(conn, workspace_id)
-            doc_text_content = str(
-                (doc.get('content') if hasattr(doc, 'get') else doc['content']) or ''
-            ).strip()
-            document_owner_username = str(
-                (doc.get('username') if hasattr(doc, 'get') else doc['username']) or ''
-            ).strip()
-            doc_file_type = str(
-                (doc.get('file_type') if hasattr(doc, 'get') else doc['file_type']) or ''
-            ).strip().lower()
-            doc_filename = str(
-                (doc.get('filename') if hasattr(doc, 'get') else doc['filename']) or ''
-            ).strip()
+            doc_text_content = str(doc['content'] or '').strip()
+            document_owner_username = str(doc['username'] or '').strip()
+            doc_file_type = str(doc['file_type'] or '').strip().lower()
+            doc_filename = str(doc['filename'] or '').strip()
             can_persist_doc_text = bool(
                 username
                 and user_can_edit_document(conn, doc, username)
@@ -1264,9 +1531,10 @@ def analyze_text():
         if not workspace_settings.get('allow_ai_tools', True):
             return jsonify({"error": "AI tools are disabled in this workspace settings"}), 403
 
-    text_content = (data.get('text') or '').strip()
+    # Bound the work at the entry point so oversized pastes never reach the regex/hash passes.
+    text_content = str(data.get('text') or '')[:ANALYZE_TEXT_MAX_CHARS].strip()
     if not text_content and doc_text_content:
-        text_content = doc_text_content
+        text_content = doc_text_content[:ANALYZE_TEXT_MAX_CHARS]
         text_source = 'document_file' if refreshed_from_file else 'document_content'
     elif not text_content:
         text_source = 'empty'
@@ -1315,7 +1583,7 @@ def analyze_text():
     use_document_cache = requested_doc_id > 0 and text_source == 'document_content'
     text_hash = build_summary_cache_text_hash(text_content)
     text_char_count = len(text_content)
-    text_word_count = len(re.findall(r'\S+', text_content))
+    text_word_count = len(text_content.split())
     base_options_used = {
         "summary_length": summary_length,
         "keyword_limit": keyword_limit,
@@ -1430,7 +1698,9 @@ def analyze_text():
                     "options_used": options_used,
                 })
 
-    summary_result = summarize_text_with_chunk_merge(text_content, length_options)
+    memoized = None if force_refresh else load_memoized_analysis(text_hash, summary_length, keyword_limit)
+    memo_hit = memoized is not None
+    summary_result = memoized if memo_hit else summarize_text_with_chunk_merge(text_content, length_options)
     summary = str(summary_result.get('summary') or '').strip()
     summary_source = str(summary_result.get('summary_source') or 'fallback').strip().lower() or 'fallback'
     summary_note = str(summary_result.get('summary_note') or '').strip()
@@ -1447,13 +1717,29 @@ def analyze_text():
             summary_note = "Summary service returned empty output."
 
     keywords = []
-    try:
-        if len(text_content.split()) > 5:
-            vectorizer = TfidfVectorizer(stop_words='english', max_features=keyword_limit)
-            vectorizer.fit_transform([text_content])
-            keywords = vectorizer.get_feature_names_out().tolist()
-    except Exception:
-        keywords = ["Not enough text"]
+    if memo_hit:
+        keywords = list(memoized.get('keywords') or [])
+    else:
+        try:
+            if len(text_content.split()) > 5:
+                # With a single document the IDF term is constant, so the top-N keywords are
+                # just the most frequent non-stop-word tokens.
+                stop_words = get_keyword_stop_words()
+                counts = Counter(
+                    token
+                    for token in _RE_KEYWORD_TOKEN.findall(text_content.lower())
+                    if token not in stop_words
+                )
+                keywords = [word for word, _ in counts.most_common(keyword_limit)]
+        except Exception:
+            keywords = ["Not enough text"]
+        save_memoized_analysis(
+            text_hash,
+            summary_length,
+            keyword_limit,
+            {**summary_result, 'summary': summary, 'summary_source': summary_source},
+            keywords,
+        )
 
     key_sentences = extract_key_sentences(text_content, keywords, limit=length_options['sentence_limit'])
 
@@ -1465,7 +1751,7 @@ def analyze_text():
         "summary_note": summary_note,
         "text_source": text_source,
         "document_id": requested_doc_id if requested_doc_id > 0 else None,
-        "cache_hit": False,
+        "cache_hit": memo_hit,
         "options_used": {
             **base_options_used,
             "chunk_count": parse_int(summary_meta.get('chunk_count'), 1, 1),
@@ -1533,30 +1819,45 @@ def uploaded_file(filename):
     # 如果配置了 S3，直接生成一个 S3 的链接跳转过去
     if S3_BUCKET and s3_client:
         try:
-            # 生成一个“预签名 URL”，有效期 1 小时 (3600秒)
-            presigned_url = s3_client.generate_presigned_url(
-                'get_object',
-                Params={'Bucket': S3_BUCKET, 'Key': filename},
-                ExpiresIn=3600
-            )
-            # 让浏览器直接跳转到 AWS S3 下载
-            return redirect(presigned_url, code=302)
+            # 生成一个“预签名 URL”，有效期 1 小时 (3600秒)；未过期前复用同一个链接
+            presigned_url, etag, max_age = get_presigned_download(filename)
         except Exception as e:
             print(f"S3 Link Generation Error: {e}")
             return jsonify({'error': 'Could not generate file link'}), 500
+
+        cache_control = f'private, max-age={max_age}, immutable'
+        # The client's cached redirect still points at a valid URL for the same object.
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            # 让浏览器直接跳转到 AWS S3 下载
+            response = redirect(presigned_url, code=302)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = cache_control
+        return response
     else:
         # 如果没配 S3 (比如本地测试)，还是从本地文件夹读
         return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
 
 # ================= 前端路由 =================
 def serve_index():
+    # index.html keeps Werkzeug's no-cache + ETag so a new deploy is picked up on the next load.
     return send_from_directory(app.static_folder, 'index.html')
 
+def send_static_asset(path):
+    if path.startswith('assets/'):
+        # Vite content-hashes everything under assets/, so a URL's bytes never change.
+        response = send_from_directory(app.static_folder, path, max_age=STATIC_ASSET_MAX_AGE_SECONDS)
+        response.cache_control.immutable = True
+        return response
+    return send_from_directory(app.static_folder, path, max_age=STATIC_FILE_MAX_AGE_SECONDS)
+
 def catch_all(path):
     if path.startswith('api/') or path.startswith('uploads/'):
         return jsonify({'error': 'Not found'}), 404
     
-    if os.path.exists(os.path.join(app.static_folder, path)):
-        return send_from_directory(app.static_folder, path)
+    # The built frontend is immutable at runtime; debug mode still re-checks disk for fresh builds.
+    if path in static_files or (app.debug and os.path.isfile(os.path.join(app.static_folder, path))):
+        return send_static_asset(path)
     
-    return send_from_directory(app.static_folder, 'index.html')
+    return serve_index()
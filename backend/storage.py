@@ -1,12 +1,32 @@
+import hashlib
+import io
 import mimetypes
 import os
+import threading
+import time
 
+from cachetools import LRUCache, TTLCache
 from flask import current_app, has_app_context
 from werkzeug.utils import secure_filename
 
 from .config import ALLOWED_EXTENSIONS, MIME_BY_EXT, S3_BUCKET, UPLOAD_FOLDER, s3_client
 
 
+PRESIGNED_URL_EXPIRES_SECONDS = 3600
+# Reuse a signed URL for most of its lifetime so browsers keep hitting the same S3 URL.
+PRESIGNED_URL_REUSE_SECONDS = 3300
+_presigned_downloads = TTLCache(maxsize=2048, ttl=PRESIGNED_URL_REUSE_SECONDS)
+_presigned_downloads_lock = threading.Lock()
+S3_MULTIPART_CHUNK_BYTES = 8 * 1024 * 1024
+S3_MAX_CONCURRENCY = 8
+_s3_transfer_config = None
+# Recently served S3 objects, keyed by storage filename and revalidated against the S3 ETag.
+S3_OBJECT_CACHE_MAX_BYTES = 128 * 1024 * 1024
+S3_OBJECT_CACHE_MAX_ITEM_BYTES = 16 * 1024 * 1024
+_s3_objects = LRUCache(maxsize=S3_OBJECT_CACHE_MAX_BYTES, getsizeof=lambda item: max(1, len(item[1])))
+_s3_objects_lock = threading.Lock()
+
+
 def _upload_folder():
     if has_app_context():
         return current_app.config.get('UPLOAD_FOLDER', UPLOAD_FOLDER)
@@ -25,10 +45,67 @@ def detect_mimetype(filename, file_ext=''):
     return guessed or 'application/octet-stream'
 
 
+def get_s3_transfer_config():
+    global _s3_transfer_config
+    if _s3_transfer_config is None:
+        from boto3.s3.transfer import TransferConfig
+
+        _s3_transfer_config = TransferConfig(
+            multipart_threshold=S3_MULTIPART_CHUNK_BYTES,
+            multipart_chunksize=S3_MULTIPART_CHUNK_BYTES,
+            max_concurrency=S3_MAX_CONCURRENCY,
+            use_threads=True,
+        )
+    return _s3_transfer_config
+
+
+def forget_cached_object(filename):
+    key = secure_filename(str(filename or '').strip())
+    with _s3_objects_lock:
+        _s3_objects.pop(key, None)
+
+
+def forget_presigned_download(filename):
+    with _presigned_downloads_lock:
+        _presigned_downloads.pop(str(filename or ''), None)
+
+
+def get_presigned_download(filename):
+    """Return (url, etag, max_age) for an S3 object, reusing a still-fresh signed URL."""
+    key = str(filename or '').strip()
+    if not key:
+        raise ValueError('filename is required')
+
+    now = time.monotonic()
+    with _presigned_downloads_lock:
+        cached = _presigned_downloads.get(key)
+    if cached and cached[2] > now:
+        return cached[0], cached[1], int(cached[2] - now)
+
+    try:
+        head = s3_client.head_object(Bucket=S3_BUCKET, Key=key)
+        object_etag = str(head.get('ETag') or '').strip('"')
+    except Exception:
+        object_etag = ''
+    url = s3_client.generate_presigned_url(
+        'get_object',
+        Params={'Bucket': S3_BUCKET, 'Key': key},
+        ExpiresIn=PRESIGNED_URL_EXPIRES_SECONDS,
+    )
+    url_digest = hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]
+    etag = f'{object_etag}-{url_digest}' if object_etag else url_digest
+    fresh_until = now + PRESIGNED_URL_REUSE_SECONDS
+    with _presigned_downloads_lock:
+        _presigned_downloads[key] = (url, etag, fresh_until)
+    return url, etag, PRESIGNED_URL_REUSE_SECONDS
+
+
 def remove_document_file_from_storage(filename):
     safe_filename = str(filename or '').strip()
     if not safe_filename:
         return ''
+    forget_presigned_download(safe_filename)
+    forget_cached_object(safe_filename)
     try:
         if S3_BUCKET and s3_client:
             s3_client.delete_object(Bucket=S3_BUCKET, Key=safe_filename)
@@ -48,11 +125,14 @@ def write_file_bytes_to_storage(filename, file_bytes, mimetype='application/octe
         raise ValueError('filename is required')
 
     if S3_BUCKET and s3_client:
-        s3_client.put_object(
-            Bucket=S3_BUCKET,
-            Key=filename,
-            Body=file_bytes,
-            ContentType=mimetype,
+        forget_presigned_download(filename)
+        forget_cached_object(filename)
+        s3_client.upload_fileobj(
+            io.BytesIO(file_bytes),
+            S3_BUCKET,
+            filename,
+            ExtraArgs={'ContentType': mimetype},
+            Config=get_s3_transfer_config(),
         )
         return
 
@@ -61,14 +141,65 @@ def write_file_bytes_to_storage(filename, file_bytes, mimetype='application/octe
         f.write(file_bytes)
 
 
+def _fetch_s3_object(key, object_etag=''):
+    s3_obj = s3_client.get_object(Bucket=S3_BUCKET, Key=key)
+    file_bytes = s3_obj['Body'].read()
+    object_etag = str(s3_obj.get('ETag') or object_etag).strip('"')
+    if object_etag and len(file_bytes) <= S3_OBJECT_CACHE_MAX_ITEM_BYTES:
+        with _s3_objects_lock:
+            _s3_objects[key] = (object_etag, file_bytes)
+    return file_bytes, object_etag
+
+
+def _cached_s3_object(key, object_etag):
+    if not object_etag:
+        return None
+    with _s3_objects_lock:
+        cached = _s3_objects.get(key)
+    if cached and cached[0] == object_etag:
+        return cached[1]
+    return None
+
+
+def open_file_from_storage(filename):
+    """Return (path_or_fileobj, etag, size) for send_file; large S3 objects are streamed, not buffered."""
+    safe_filename = secure_filename(str(filename or '').strip())
+    if not safe_filename:
+        raise ValueError('filename is required')
+
+    if S3_BUCKET and s3_client:
+        # HEAD is a cheap revalidation; the body is only fetched when the ETag moved.
+        head = s3_client.head_object(Bucket=S3_BUCKET, Key=safe_filename)
+        object_etag = str(head.get('ETag') or '').strip('"')
+        object_size = head.get('ContentLength')
+        cached_bytes = _cached_s3_object(safe_filename, object_etag)
+        if cached_bytes is not None:
+            return io.BytesIO(cached_bytes), object_etag, len(cached_bytes)
+        if isinstance(object_size, int) and object_size > S3_OBJECT_CACHE_MAX_ITEM_BYTES:
+            s3_obj = s3_client.get_object(Bucket=S3_BUCKET, Key=safe_filename)
+            return s3_obj['Body'], object_etag, object_size
+        file_bytes, object_etag = _fetch_s3_object(safe_filename, object_etag)
+        return io.BytesIO(file_bytes), object_etag, len(file_bytes)
+
+    # Absolute path: flask.send_file would resolve a relative one against app.root_path.
+    local_path = os.path.abspath(os.path.join(_upload_folder(), safe_filename))
+    stat = os.stat(local_path)
+    return local_path, f'{stat.st_mtime_ns:x}-{stat.st_size:x}', stat.st_size
+
+
 def read_file_bytes_from_storage(filename):
     safe_filename = secure_filename(str(filename or '').strip())
     if not safe_filename:
         raise ValueError('filename is required')
 
     if S3_BUCKET and s3_client:
-        s3_obj = s3_client.get_object(Bucket=S3_BUCKET, Key=safe_filename)
-        return s3_obj['Body'].read()
+        # HEAD revalidates the cached copy; the body is only downloaded when the ETag moved.
+        head = s3_client.head_object(Bucket=S3_BUCKET, Key=safe_filename)
+        object_etag = str(head.get('ETag') or '').strip('"')
+        cached_bytes = _cached_s3_object(safe_filename, object_etag)
+        if cached_bytes is not None:
+            return cached_bytes
+        return _fetch_s3_object(safe_filename, object_etag)[0]
 
     local_path = os.path.join(_upload_folder(), safe_filename)
     with open(local_path, 'rb') as f:
@@ -80,6 +211,11 @@ __all__ = [
     'UPLOAD_FOLDER',
     'allowed_file',
     'detect_mimetype',
+    'forget_cached_object',
+    'forget_presigned_download',
+    'get_presigned_download',
+    'get_s3_transfer_config',
+    'open_file_from_storage',
     'read_file_bytes_from_storage',
     'remove_document_file_from_storage',
     'write_file_bytes_to_storage',
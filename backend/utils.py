@@ -1,6 +1,16 @@
+import functools
 import re
+import sqlite3
 from datetime import datetime, timezone
 
+import requests
+from requests.adapters import HTTPAdapter
+
+
+# Shared keep-alive session for outbound API calls (Resend, Hugging Face).
+http_session = requests.Session()
+http_session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=2))
+
 
 def utcnow_iso():
     return datetime.utcnow().isoformat()
@@ -11,18 +21,17 @@ def row_to_dict(row):
         return None
     if isinstance(row, dict):
         return dict(row)
+    if isinstance(row, sqlite3.Row):
+        return dict(zip(row.keys(), row))
     if hasattr(row, 'keys'):
         return {key: row[key] for key in row.keys()}
     return dict(row)
 
 
-def parse_iso_datetime(value):
-    raw = str(value or '').strip()
-    if not raw:
-        return None
-    normalized = raw.replace('Z', '+00:00')
+@functools.lru_cache(maxsize=4096)
+def _parse_iso_datetime_cached(raw):
     try:
-        dt = datetime.fromisoformat(normalized)
+        dt = datetime.fromisoformat(raw.replace('Z', '+00:00'))
     except Exception:
         return None
     if dt.tzinfo is not None:
@@ -30,6 +39,17 @@ def parse_iso_datetime(value):
     return dt
 
 
+def parse_iso_datetime(value):
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            return value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+    raw = str(value or '').strip()
+    if not raw:
+        return None
+    return _parse_iso_datetime_cached(raw)
+
+
 def invitation_is_expired(expires_at):
     dt = parse_iso_datetime(expires_at)
     if dt is None:
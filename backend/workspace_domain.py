@@ -4,8 +4,6 @@ import uuid
 import html
 from datetime import datetime, timedelta
 
-import requests
-
 from .config import (
     CATEGORY_KEYWORDS,
     DEFAULT_DOCUMENT_CATEGORY,
@@ -23,7 +21,22 @@ from .config import (
     WORKSPACE_SUMMARY_LENGTH_LEVELS,
 )
 from .db import documents_column_exists
-from .utils import normalize_document_category, normalize_email, parse_bool, parse_int, row_to_dict, utcnow_iso
+from .utils import (
+    http_session,
+    normalize_document_category,
+    normalize_email,
+    parse_bool,
+    parse_int,
+    row_to_dict,
+    utcnow_iso,
+)
+
+
+_RE_EMAIL = re.compile(r'[^@\s]+@[^@\s]+\.[^@\s]+')
+_RE_ACCENT_HEX = re.compile(r'#[0-9a-f]{6}')
+_RE_EMAIL_DOMAIN = re.compile(r'[a-z0-9.-]{3,255}')
+_RE_LIST_SPLIT = re.compile(r'[\n,;]+')
+_RE_WHITESPACE = re.compile(r'\s+')
 
 
 def normalize_workspace_name(name, owner_username=''):
@@ -43,7 +56,7 @@ def normalize_workspace_name(name, owner_username=''):
 
 def normalize_workspace_accent_color(value):
     raw = str(value or '').strip().lower()
-    if re.fullmatch(r'#[0-9a-f]{6}', raw):
+    if _RE_ACCENT_HEX.fullmatch(raw):
         return raw
     return DEFAULT_WORKSPACE_SETTINGS['accent_color']
 
@@ -55,7 +68,7 @@ def normalize_workspace_domain_token(value):
     raw = raw.split('/', 1)[0].strip()
     if not raw or '.' not in raw:
         return ''
-    if not re.fullmatch(r'[a-z0-9.-]{3,255}', raw):
+    if not _RE_EMAIL_DOMAIN.fullmatch(raw):
         return ''
     return raw
 
@@ -64,7 +77,7 @@ def normalize_workspace_domain_list(value):
     if isinstance(value, list):
         candidates = value
     else:
-        candidates = re.split(r'[\n,;]+', str(value or ''))
+        candidates = _RE_LIST_SPLIT.split(str(value or ''))
     output = []
     seen = set()
     for item in candidates:
@@ -92,7 +105,7 @@ def normalize_workspace_settings(raw_settings):
     base['workspace_icon'] = workspace_icon[:2] or DEFAULT_WORKSPACE_SETTINGS['workspace_icon']
 
     description = str(source.get('description', base['description']) or '').strip()
-    base['description'] = re.sub(r'\s+', ' ', description)[:220]
+    base['description'] = _RE_WHITESPACE.sub(' ', description)[:220]
     base['accent_color'] = normalize_workspace_accent_color(source.get('accent_color', base['accent_color']))
 
     default_category = normalize_document_category(source.get('default_category', base['default_category']))
@@ -223,7 +236,7 @@ def workspace_settings_to_json(value):
 
 def is_valid_email(value):
     email = normalize_email(value)
-    return bool(re.fullmatch(r'[^@\s]+@[^@\s]+\.[^@\s]+', email))
+    return bool(_RE_EMAIL.fullmatch(email))
 
 
 def expires_at_for_days(days):
@@ -289,7 +302,7 @@ def send_workspace_invite_email(to_email, workspace_name, inviter_username, invi
         'text': text,
     }
     try:
-        response = requests.post(
+        response = http_session.post(
             'https://api.resend.com/emails',
             headers={
                 'Authorization': f'Bearer {RESEND_API_KEY}',
@@ -330,6 +343,52 @@ def expire_workspace_invitations(conn, workspace_id=''):
         )
 
 
+def expire_and_list_workspace_invitations(conn, workspace_id, limit=200):
+    safe_limit = parse_int(limit, 200, 1, 500)
+    if getattr(conn, 'db_type', '') != 'postgres':
+        expire_workspace_invitations(conn, workspace_id)
+        cursor = conn.execute(
+            '''
+            SELECT *
+            FROM workspace_invitations
+            WHERE workspace_id = ?
+            ORDER BY created_at DESC
+            LIMIT ?
+            ''',
+            (workspace_id, safe_limit),
+        )
+        return [row_to_dict(item) for item in cursor.fetchall()]
+
+    # Expire and read in one statement. The outer SELECT still sees the pre-UPDATE
+    # snapshot, so rows flagged by the CTE get their status patched below.
+    cursor = conn.execute(
+        '''
+        WITH expired AS (
+            UPDATE workspace_invitations
+            SET status = 'expired'
+            WHERE workspace_id = ?
+              AND status IN ('pending', 'requested')
+              AND expires_at < ?
+            RETURNING id
+        )
+        SELECT i.*, (e.id IS NOT NULL) AS just_expired
+        FROM workspace_invitations i
+        LEFT JOIN expired e ON e.id = i.id
+        WHERE i.workspace_id = ?
+        ORDER BY i.created_at DESC
+        LIMIT ?
+        ''',
+        (workspace_id, utcnow_iso(), workspace_id, safe_limit),
+    )
+    rows = []
+    for item in cursor.fetchall():
+        row = row_to_dict(item)
+        if row.pop('just_expired', False):
+            row['status'] = 'expired'
+        rows.append(row)
+    return rows
+
+
 def serialize_invitation_row(row):
     data = row_to_dict(row) or {}
     return {
@@ -382,19 +441,18 @@ def get_workspace_record(conn, workspace_id):
 def workspace_belongs_to_user(conn, workspace_id, username):
     if not username:
         return False
-    owner_cursor = conn.execute(
-        'SELECT 1 FROM workspaces WHERE id = ? AND owner_username = ?',
-        (workspace_id, username),
-    )
-    if owner_cursor.fetchone() is not None:
-        return True
     cursor = conn.execute(
         '''
         SELECT 1
+        FROM workspaces
+        WHERE id = ? AND owner_username = ?
+        UNION ALL
+        SELECT 1
         FROM workspace_members
         WHERE workspace_id = ? AND username = ? AND status = 'active'
+        LIMIT 1
         ''',
-        (workspace_id, username),
+        (workspace_id, username, workspace_id, username),
     )
     return cursor.fetchone() is not None
 
@@ -476,12 +534,31 @@ def backfill_documents_workspace_ids(conn):
         )
 
 
-def get_workspace_details(conn, workspace_row, for_username=''):
-    workspace = row_to_dict(workspace_row) or {}
-    workspace_id = workspace.get('id', '')
-    owner_username = workspace.get('owner_username', '')
-    is_owner = bool(for_username and for_username == owner_username)
-    settings = normalize_workspace_settings(workspace.get('settings_json'))
+def fetch_workspace_members_and_invitations(conn, workspace_id, include_invitations=False):
+    if include_invitations and getattr(conn, 'db_type', '') == 'postgres':
+        # Postgres: ship both lists back as JSON arrays on one row to save a round-trip.
+        cursor = conn.execute(
+            '''
+            SELECT
+                (
+                    SELECT COALESCE(json_agg(m ORDER BY m.created_at ASC), '[]'::json)
+                    FROM (
+                        SELECT username, role, status, created_at
+                        FROM workspace_members
+                        WHERE workspace_id = ? AND status = 'active'
+                    ) m
+                ) AS members,
+                (
+                    SELECT COALESCE(json_agg(i ORDER BY i.created_at DESC), '[]'::json)
+                    FROM workspace_invitations i
+                    WHERE i.workspace_id = ?
+                      AND i.status IN ('pending', 'requested')
+                ) AS invitations
+            ''',
+            (workspace_id, workspace_id),
+        )
+        row = row_to_dict(cursor.fetchone()) or {}
+        return list(row.get('members') or []), list(row.get('invitations') or [])
 
     members_cursor = conn.execute(
         '''
@@ -492,11 +569,13 @@ def get_workspace_details(conn, workspace_row, for_username=''):
         ''',
         (workspace_id,),
     )
-    members = [row_to_dict(item) for item in members_cursor.fetchall()]
+    members = members_cursor.fetchall()
+    if getattr(conn, 'db_type', '') != 'postgres':
+        # RealDictCursor rows are already dicts; only sqlite3.Row needs converting.
+        members = [row_to_dict(item) for item in members]
 
-    pending_requests = []
     invitations = []
-    if is_owner:
+    if include_invitations:
         invite_cursor = conn.execute(
             '''
             SELECT *
@@ -507,8 +586,20 @@ def get_workspace_details(conn, workspace_row, for_username=''):
             ''',
             (workspace_id,),
         )
-        invitations = [serialize_invitation_row(item) for item in invite_cursor.fetchall()]
-        pending_requests = [item for item in invitations if item.get('status') == 'requested']
+        invitations = invite_cursor.fetchall()
+    return members, invitations
+
+
+def get_workspace_details(conn, workspace_row, for_username=''):
+    workspace = row_to_dict(workspace_row) or {}
+    workspace_id = workspace.get('id', '')
+    owner_username = workspace.get('owner_username', '')
+    is_owner = bool(for_username and for_username == owner_username)
+    settings = normalize_workspace_settings(workspace.get('settings_json'))
+
+    members, invitation_rows = fetch_workspace_members_and_invitations(conn, workspace_id, is_owner)
+    invitations = [serialize_invitation_row(item) for item in invitation_rows]
+    pending_requests = [item for item in invitations if item.get('status') == 'requested']
 
     return {
         'id': workspace_id,
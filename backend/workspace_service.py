@@ -1,5 +1,6 @@
 import re
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 from flask import jsonify, request
 
@@ -10,6 +11,7 @@ from .utils import invitation_is_expired, normalize_email, parse_int, row_to_dic
 from .workspace_domain import (
     create_invite_token,
     ensure_owner_membership,
+    expire_and_list_workspace_invitations,
     expire_workspace_invitations,
     expires_at_for_days,
     get_workspace_details,
@@ -24,6 +26,15 @@ from .workspace_domain import (
 )
 
 
+_RE_EMAIL_LIST_SPLIT = re.compile(r'[\n,;]+')
+_RE_DOMAIN_LIST_SPLIT = re.compile(r'[\s,;]+')
+INVITE_EMAIL_MAX_WORKERS = 8
+_invite_email_executor = ThreadPoolExecutor(
+    max_workers=INVITE_EMAIL_MAX_WORKERS,
+    thread_name_prefix='invite-email',
+)
+
+
 def _user_can_manage_workspace_invites(conn, workspace_row, username, workspace_settings=None):
     actor = (username or '').strip()
     workspace = workspace_row or {}
@@ -64,36 +75,26 @@ def get_workspaces():
     try:
         expire_workspace_invitations(conn)
 
-        owned_cursor = conn.execute(
-            'SELECT * FROM workspaces WHERE owner_username = ? ORDER BY created_at DESC',
-            (username,),
-        )
-        owned_rows = [row_to_dict(item) for item in owned_cursor.fetchall()]
-
-        member_cursor = conn.execute(
+        workspace_cursor = conn.execute(
             '''
-            SELECT workspace_id
-            FROM workspace_members
-            WHERE username = ? AND status = 'active'
+            SELECT w.*, 0 AS owner_rank
+            FROM workspaces w
+            WHERE w.owner_username = ?
+            UNION ALL
+            SELECT w.*, 1 AS owner_rank
+            FROM workspaces w
+            JOIN workspace_members m ON m.workspace_id = w.id
+            WHERE m.username = ? AND m.status = 'active' AND w.owner_username <> ?
+            ORDER BY owner_rank ASC, created_at DESC
             ''',
-            (username,),
+            (username, username, username),
         )
-        member_workspace_ids = [
-            row_to_dict(item).get('workspace_id')
-            for item in member_cursor.fetchall()
-            if row_to_dict(item).get('workspace_id')
-        ]
-        owned_ids = {item.get('id') for item in owned_rows}
-        extra_ids = [workspace_id for workspace_id in member_workspace_ids if workspace_id not in owned_ids]
-
-        extra_rows = []
-        if extra_ids:
-            placeholders = ','.join(['?'] * len(extra_ids))
-            query = f'SELECT * FROM workspaces WHERE id IN ({placeholders}) ORDER BY created_at DESC'
-            extra_cursor = conn.execute(query, tuple(extra_ids))
-            extra_rows = [row_to_dict(item) for item in extra_cursor.fetchall()]
+        workspace_rows = []
+        for item in workspace_cursor.fetchall():
+            row = row_to_dict(item)
+            row.pop('owner_rank', None)
+            workspace_rows.append(row)
 
-        workspace_rows = [*owned_rows, *extra_rows]
         if not workspace_rows:
             now_iso = utcnow_iso()
             workspace_id = f'ws-{uuid.uuid4().hex[:12]}'
@@ -287,19 +288,9 @@ def list_workspace_invitations(workspace_id):
         if workspace_row.get('owner_username') != username:
             return jsonify({'error': 'Only workspace owner can view invitations'}), 403
 
-        expire_workspace_invitations(conn, workspace_id)
+        invitation_rows = expire_and_list_workspace_invitations(conn, workspace_id, 200)
         conn.commit()
-        cursor = conn.execute(
-            '''
-            SELECT *
-            FROM workspace_invitations
-            WHERE workspace_id = ?
-            ORDER BY created_at DESC
-            LIMIT 200
-            ''',
-            (workspace_id,),
-        )
-        invitations = [serialize_invitation_row(item) for item in cursor.fetchall()]
+        invitations = [serialize_invitation_row(item) for item in invitation_rows]
         return jsonify(invitations), 200
     finally:
         conn.close()
@@ -315,7 +306,7 @@ def create_workspace_invitations(workspace_id):
         return jsonify({'error': 'username is required'}), 400
 
     if isinstance(raw_emails, str):
-        candidates = [item.strip() for item in re.split(r'[\n,;]+', raw_emails) if item.strip()]
+        candidates = [item for item in map(str.strip, _RE_EMAIL_LIST_SPLIT.split(raw_emails)) if item]
     elif isinstance(raw_emails, list):
         candidates = [str(item).strip() for item in raw_emails if str(item).strip()]
     else:
@@ -346,7 +337,7 @@ def create_workspace_invitations(workspace_id):
             return jsonify({'error': 'Only workspace owner can invite members'}), 403
 
         trusted_domains = [
-            item for item in re.split(r'[\s,;]+', workspace_settings.get('allowed_email_domains', '')) if item
+            item for item in _RE_DOMAIN_LIST_SPLIT.split(workspace_settings.get('allowed_email_domains', '')) if item
         ]
         if workspace_settings.get('restrict_invites_to_domains') and trusted_domains:
             invalid_domain_emails = [
@@ -371,48 +362,64 @@ def create_workspace_invitations(workspace_id):
         created_items = []
         send_errors = []
 
-        for email in normalized_emails:
-            conn.execute(
-                '''
-                UPDATE workspace_invitations
-                SET status = 'cancelled', reviewed_by = ?, reviewed_at = ?, review_note = ?
-                WHERE workspace_id = ?
-                  AND email = ?
-                  AND status IN ('pending', 'requested')
-                ''',
-                (username, now_iso, 'Replaced by newer invitation', workspace_id, email),
-            )
+        email_placeholders = ', '.join('?' for _ in normalized_emails)
+        conn.execute(
+            f'''
+            UPDATE workspace_invitations
+            SET status = 'cancelled', reviewed_by = ?, reviewed_at = ?, review_note = ?
+            WHERE workspace_id = ?
+              AND email IN ({email_placeholders})
+              AND status IN ('pending', 'requested')
+            ''',
+            (username, now_iso, 'Replaced by newer invitation', workspace_id, *normalized_emails),
+        )
 
-            token = create_invite_token()
-            conn.execute(
-                '''
-                INSERT INTO workspace_invitations (
-                    workspace_id, email, token, status, expires_at, created_at
-                ) VALUES (?, ?, ?, ?, ?, ?)
-                ''',
-                (workspace_id, email, token, 'pending', expires_at, now_iso),
-            )
+        tokens = [create_invite_token() for _ in normalized_emails]
+        conn.executemany(
+            '''
+            INSERT INTO workspace_invitations (
+                workspace_id, email, token, status, expires_at, created_at
+            ) VALUES (?, ?, ?, ?, ?, ?)
+            ''',
+            [
+                (workspace_id, email, token, 'pending', expires_at, now_iso)
+                for email, token in zip(normalized_emails, tokens)
+            ],
+        )
 
-            invite_row_cursor = conn.execute(
-                '''
-                SELECT *
-                FROM workspace_invitations
-                WHERE token = ?
-                ''',
-                (token,),
-            )
-            invite_row = row_to_dict(invite_row_cursor.fetchone())
-            invite_payload, ok, send_error = _deliver_workspace_invitation_email(
+        token_placeholders = ', '.join('?' for _ in tokens)
+        invite_row_cursor = conn.execute(
+            f'''
+            SELECT *
+            FROM workspace_invitations
+            WHERE token IN ({token_placeholders})
+            ''',
+            tuple(tokens),
+        )
+        invite_rows_by_token = {
+            row.get('token'): row
+            for row in (row_to_dict(item) for item in invite_row_cursor.fetchall())
+        }
+        # Commit before the mail API round-trips so the write lock isn't held while mail is sent.
+        conn.commit()
+
+        # Each send is an independent HTTPS call; run them side by side and collect in input order.
+        delivery_futures = [
+            _invite_email_executor.submit(
+                _deliver_workspace_invitation_email,
                 workspace_row,
-                invite_row,
+                invite_rows_by_token.get(token),
                 username,
             )
+            for token in tokens
+        ]
+        for email, future in zip(normalized_emails, delivery_futures):
+            invite_payload, ok, send_error = future.result()
             if not ok:
                 send_errors.append({'email': email, 'error': send_error})
 
             created_items.append(invite_payload)
 
-        conn.commit()
         email_sent_count = len([item for item in created_items if item.get('email_sent')])
         return jsonify({
             'workspace_id': workspace_id,
@@ -459,21 +466,17 @@ def cancel_workspace_invitation(workspace_id, invitation_id):
         if invitation.get('status') in ('approved', 'rejected', 'expired', 'cancelled'):
             return jsonify({'error': f'Invitation is already {invitation.get("status")}'}), 400
 
-        conn.execute(
+        refreshed_cursor = conn.execute(
             '''
             UPDATE workspace_invitations
             SET status = 'cancelled', reviewed_by = ?, reviewed_at = ?, review_note = ?
             WHERE id = ?
+            RETURNING *
             ''',
             (username, utcnow_iso(), 'Cancelled by owner', invitation_id),
         )
-        conn.commit()
-
-        refreshed_cursor = conn.execute(
-            'SELECT * FROM workspace_invitations WHERE id = ?',
-            (invitation_id,),
-        )
         refreshed = serialize_invitation_row(refreshed_cursor.fetchone())
+        conn.commit()
         return jsonify(refreshed), 200
     finally:
         conn.close()
@@ -518,7 +521,7 @@ def resend_workspace_invitation(workspace_id, invitation_id):
         next_expires_at = expires_at_for_days(
             workspace_settings.get('default_invite_expiry_days', INVITE_EXPIRY_DAYS)
         )
-        conn.execute(
+        refreshed_cursor = conn.execute(
             '''
             UPDATE workspace_invitations
             SET status = 'pending',
@@ -529,20 +532,12 @@ def resend_workspace_invitation(workspace_id, invitation_id):
                 reviewed_at = NULL,
                 review_note = ''
             WHERE id = ?
+            RETURNING *
             ''',
             (next_expires_at, invitation_id),
         )
-        conn.commit()
-
-        refreshed_cursor = conn.execute(
-            '''
-            SELECT *
-            FROM workspace_invitations
-            WHERE id = ?
-            ''',
-            (invitation_id,),
-        )
         refreshed = row_to_dict(refreshed_cursor.fetchone())
+        conn.commit()
         invite_payload, ok, send_error = _deliver_workspace_invitation_email(
             workspace_row,
             refreshed,
@@ -635,18 +630,17 @@ def review_workspace_invitation(workspace_id, invitation_id):
         else:
             next_status = 'rejected'
 
-        conn.execute(
+        updated_cursor = conn.execute(
             '''
             UPDATE workspace_invitations
             SET status = ?, reviewed_by = ?, reviewed_at = ?, review_note = ?
             WHERE id = ?
+            RETURNING *
             ''',
             (next_status, username, utcnow_iso(), note, invitation_id),
         )
-        conn.commit()
-
-        updated_cursor = conn.execute('SELECT * FROM workspace_invitations WHERE id = ?', (invitation_id,))
         updated_invitation = serialize_invitation_row(updated_cursor.fetchone())
+        conn.commit()
         return jsonify(updated_invitation), 200
     finally:
         conn.close()
@@ -664,16 +658,19 @@ def get_invitation_by_token(token):
     try:
         cursor = conn.execute(
             '''
-            SELECT inv.*, ws.name AS workspace_name, ws.owner_username
+            SELECT inv.*, ws.name AS workspace_name, ws.owner_username,
+                   (SELECT email FROM users WHERE username = ?) AS viewer_email
             FROM workspace_invitations inv
             JOIN workspaces ws ON ws.id = inv.workspace_id
             WHERE inv.token = ?
             ''',
-            (safe_token,),
+            (username, safe_token),
         )
         invitation = row_to_dict(cursor.fetchone())
         if not invitation:
             return jsonify({'error': 'Invitation not found'}), 404
+        # The viewer's email rides along with the invitation row instead of a second query.
+        user_email = normalize_email(invitation.pop('viewer_email', ''))
 
         if invitation.get('status') in ('pending', 'requested') and invitation_is_expired(invitation.get('expires_at')):
             conn.execute(
@@ -685,11 +682,7 @@ def get_invitation_by_token(token):
 
         can_request = False
         mismatch_reason = ''
-        user_email = ''
         if username:
-            user_cursor = conn.execute('SELECT email FROM users WHERE username = ?', (username,))
-            user_row = row_to_dict(user_cursor.fetchone()) or {}
-            user_email = normalize_email(user_row.get('email', ''))
             invite_email = normalize_email(invitation.get('email', ''))
             if not user_email:
                 mismatch_reason = 'The current account has no bound email, so invitation ownership cannot be verified'
@@ -733,16 +726,18 @@ def request_join_by_invitation(token):
     try:
         cursor = conn.execute(
             '''
-            SELECT inv.*, ws.name AS workspace_name, ws.owner_username
+            SELECT inv.*, ws.name AS workspace_name, ws.owner_username,
+                   (SELECT email FROM users WHERE username = ?) AS viewer_email
             FROM workspace_invitations inv
             JOIN workspaces ws ON ws.id = inv.workspace_id
             WHERE inv.token = ?
             ''',
-            (safe_token,),
+            (username, safe_token),
         )
         invitation = row_to_dict(cursor.fetchone())
         if not invitation:
             return jsonify({'error': 'Invitation not found'}), 404
+        user_email = normalize_email(invitation.pop('viewer_email', ''))
 
         if invitation.get('status') in ('approved', 'rejected', 'expired', 'cancelled'):
             return jsonify({'error': f'Invitation is {invitation.get("status")}'}), 400
@@ -754,9 +749,6 @@ def request_join_by_invitation(token):
             conn.commit()
             return jsonify({'error': 'Invitation has expired'}), 400
 
-        user_cursor = conn.execute('SELECT email FROM users WHERE username = ?', (username,))
-        user_row = row_to_dict(user_cursor.fetchone()) or {}
-        user_email = normalize_email(user_row.get('email', ''))
         invite_email = normalize_email(invitation.get('email', ''))
         if not user_email:
             return jsonify({'error': 'Your account has no email address; cannot match invitation'}), 400
@@ -1,7 +1,9 @@
 import sqlite3
 
-# 连接数据库
-conn = sqlite3.connect('studyhub.db')
+from backend.db import SQLITE_DB_PATH
+
+# 连接应用实际使用的 SQLite 数据库
+conn = sqlite3.connect(SQLITE_DB_PATH)
 cursor = conn.cursor()
 
 # 删除 users 表中的所有数据
@@ -9,6 +11,9 @@ cursor.execute('DELETE FROM users')
 
 # 提交更改
 conn.commit()
+
+# 不带 WHERE 的 DELETE 已走 SQLite 的整表清空快速路径；VACUUM 再把空出的页面还给磁盘
+conn.execute('VACUUM')
 conn.close()
 
 print("所有用户数据已清空！")
\ No newline at end of file